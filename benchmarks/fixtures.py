@@ -0,0 +1,67 @@
+"""
+Synthetic frames and landmarks for the benchmarks. The landmarks are the
+3D face model of training_data_NEW/model.txt projected at a known pose, and
+the frame is a simple drawing of that face, enough for the eyes, pupils and
+calibration to have something to work on. No webcam or shape predictor
+model is needed.
+"""
+import os
+import numpy as np
+import cv2
+
+MODEL_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "training_data_NEW", "model.txt"
+)
+
+RESOLUTIONS = {
+    '480p': (640, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+}
+
+
+def model_points():
+    """Returns the (68, 3) face model, x, y and z are stored one after the other"""
+    return np.loadtxt(MODEL_PATH).reshape(3, -1).T
+
+
+def landmarks(dimensions, yaw=0.0, shift=(0.0, 0.0)):
+    """Returns (68, 2) landmarks of a face filling about a third of the frame height.
+
+    Arguments:
+        dimensions (tuple): Width and height of the frame
+        yaw (float): Rotation of the head around the vertical axis, in radians
+        shift (tuple): Translation of the face in pixels
+    """
+    width, height = dimensions
+    points = model_points() * np.array([1.0, 1.0, -1.0])
+    # the model is about 150 units high
+    distance = 150.0 * 3 * width / height
+    camera_matrix = np.array(
+        [[width, 0, width / 2], [0, width, height / 2], [0, 0, 1]], dtype="double"
+    )
+    projected, _ = cv2.projectPoints(
+        points, np.array([0.0, yaw, 0.0]), np.array([0.0, 0.0, distance]),
+        camera_matrix, np.zeros(4)
+    )
+    return projected.reshape(-1, 2) + shift
+
+
+def frame(dimensions, points, seed=0):
+    """Returns a BGR frame with a face drawn around the landmarks"""
+    width, height = dimensions
+    rng = np.random.default_rng(seed)
+    image = rng.integers(90, 110, (height, width, 3), dtype=np.uint8)
+
+    contour = points[0:17].astype(np.int32)
+    cv2.fillPoly(image, [cv2.convexHull(np.vstack((contour, points[17:27].astype(np.int32))))], (150, 170, 200))
+    for eye in (points[36:42], points[42:48]):
+        cv2.fillPoly(image, [eye.astype(np.int32)], (235, 235, 235))
+        center = tuple(int(v) for v in eye.mean(axis=0))
+        radius = max(int((eye[:, 1].max() - eye[:, 1].min()) / 2), 2)
+        cv2.circle(image, center, radius, (40, 40, 40), -1)
+    for brow in (points[17:22], points[22:27]):
+        cv2.polylines(image, [brow.astype(np.int32)], False, (40, 50, 60), 3)
+    cv2.fillPoly(image, [points[48:60].astype(np.int32)], (80, 80, 160))
+    return image
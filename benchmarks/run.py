@@ -0,0 +1,191 @@
+"""
+Benchmarks every stage of the per-frame analysis on synthetic frames.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --output new.json --compare results.json
+
+For each resolution and stage, the latency percentiles (ms), the throughput
+(calls/s) and the memory allocated by Python and NumPy during a call are
+saved to JSON. Allocations made inside OpenCV are not seen by tracemalloc.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+import numpy as np
+import cv2
+from gaze_tracking.calibration import Calibration
+from gaze_tracking.eye import Eye
+from gaze_tracking.face import Face
+from gaze_tracking.filters import KalmanFilter, OneEuroFilter
+from gaze_tracking.landmarks import Landmarks
+from gaze_tracking.pupil import Pupil
+from gaze_tracking.renderer import AnnotationRenderer
+from gaze_tracking.session import FaceSession
+from gaze_tracking.utils.calculators import ThreeDimensionalCalc
+from . import fixtures
+
+PERCENTILES = (50, 90, 99)
+
+
+def stages(dimensions):
+    """Returns the benchmarked stages, each a function analysing the synthetic frame once"""
+    points = fixtures.landmarks(dimensions)
+    frame = fixtures.frame(dimensions, points)
+    greyframe = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    landmarks = Landmarks(np.round(points).astype(np.int32))
+
+    # steady state, the calibration is over
+    session = FaceSession(dimensions)
+    while not session.calibration.is_complete():
+        face = session.analyze(frame, landmarks)
+    eye = face.eyes[0]
+    threshold = session.calibration.threshold(0)
+    previous = (eye.pupil.x, eye.pupil.y)
+    camera_specs = session.camera_specs
+    feature_points = [feature.feature_reference_point for feature in face.features()]
+    canvas = frame.copy()
+    renderer = AnnotationRenderer()
+    overlay_renderer = AnnotationRenderer(overlay=True)
+    one_euro = OneEuroFilter()
+    kalman = KalmanFilter()
+
+    def annotate():
+        np.copyto(canvas, frame)
+        face.annotate(canvas)
+        face.draw_vecs(canvas)
+
+    def render():
+        np.copyto(canvas, frame)
+        renderer.render(canvas, [face])
+
+    def render_overlay():
+        np.copyto(canvas, frame)
+        overlay_renderer.render(canvas, [face])
+
+    return OrderedDict([
+        ('face.analyze', lambda: session.analyze(frame, landmarks)),
+        ('face.analyze.calibrating', lambda: Face(frame, dimensions, landmarks).analyze()),
+        ('eye.isolate', lambda: eye._isolate(greyframe, landmarks, Eye.LEFT_EYE_POINTS)),
+        ('pupil.detect_iris', lambda: Pupil(eye.frame, threshold)),
+        ('pupil.track_iris', lambda: Pupil(eye.frame, threshold, previous)),
+        ('calibration.find_best_threshold', lambda: Calibration.find_best_threshold(eye.frame)),
+        ('three_dimensional_calc', lambda: ThreeDimensionalCalc(
+            face.rotational_vector, face.translation_vector,
+            camera_specs.camera_matrix, dimensions, projection=camera_specs.projection
+        ).to_3d_batch(feature_points)),
+        ('filters.one_euro', lambda: one_euro(points)),
+        ('filters.kalman', lambda: kalman(points)),
+        ('face.annotate', annotate),
+        ('renderer.render', render),
+        ('renderer.render.overlay', render_overlay),
+        ('renderer.composite', lambda: overlay_renderer.composite(canvas)),
+    ])
+
+
+def measure(function, iterations, warmup=10, allocation_iterations=20):
+    """Returns the latency percentiles, throughput and allocations of a function"""
+    for _ in range(warmup):
+        function()
+
+    latencies = np.empty(iterations)
+    for i in range(iterations):
+        started = time.perf_counter()
+        function()
+        latencies[i] = time.perf_counter() - started
+
+    allocations = []
+    tracemalloc.start()
+    for _ in range(allocation_iterations):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function()
+        allocations.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    result = OrderedDict(
+        ('p{}_ms'.format(percentile), float(np.percentile(latencies, percentile) * 1e3))
+        for percentile in PERCENTILES
+    )
+    result['mean_ms'] = float(latencies.mean() * 1e3)
+    result['throughput'] = float(1.0 / latencies.mean())
+    result['allocated_bytes'] = int(np.median(allocations))
+    return result
+
+
+def run(resolutions, iterations):
+    results = OrderedDict()
+    for name in resolutions:
+        dimensions = fixtures.RESOLUTIONS[name]
+        results[name] = OrderedDict(
+            (stage, measure(function, iterations))
+            for stage, function in stages(dimensions).items()
+        )
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'iterations': iterations,
+        'results': results,
+    }
+
+
+def compare(current, previous, tolerance):
+    """Prints the p50 latency change of every stage against a previous run.
+
+    Returns:
+        The number of stages slower than the previous run by more than tolerance
+    """
+    regressions = 0
+    for resolution, stages_results in current['results'].items():
+        for stage, result in stages_results.items():
+            try:
+                before = previous['results'][resolution][stage]['p50_ms']
+            except KeyError:
+                continue
+            ratio = result['p50_ms'] / before if before else float('inf')
+            slower = ratio > 1 + tolerance
+            regressions += slower
+            print("{:6} {:34} {:8.3f}ms -> {:8.3f}ms  x{:.2f}{}".format(
+                resolution, stage, before, result['p50_ms'], ratio, "  REGRESSION" if slower else ""
+            ))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the per-frame analysis stages")
+    parser.add_argument('--resolutions', nargs='+', default=list(fixtures.RESOLUTIONS),
+                        choices=list(fixtures.RESOLUTIONS))
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--output', default='benchmark.json', help="JSON file of the results")
+    parser.add_argument('--compare', help="JSON file of a previous run")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="p50 slowdown over which a stage counts as a regression")
+    args = parser.parse_args()
+
+    current = run(args.resolutions, args.iterations)
+    with open(args.output, 'w') as file:
+        json.dump(current, file, indent=2)
+
+    for resolution, stages_results in current['results'].items():
+        for stage, result in stages_results.items():
+            print("{:6} {:34} p50 {:8.3f}ms  p99 {:8.3f}ms  {:9.1f}/s  {:9d}B".format(
+                resolution, stage, result['p50_ms'], result['p99_ms'],
+                result['throughput'], result['allocated_bytes']
+            ))
+
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+        print()
+        if compare(current, previous, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
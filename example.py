@@ -5,10 +5,14 @@ Check the README.md for complete documentation
 import cv2
 import os
 import dlib
-from gaze_tracking.face import Face
-import numpy as np
+from functools import partial
+from gaze_tracking.filters import OneEuroFilter
+from gaze_tracking.session import MultiFaceSession
+from gaze_tracking.locator import FaceLocator
+from gaze_tracking.pipeline import Pipeline
+from gaze_tracking.renderer import AnnotationRenderer
+from gaze_tracking.scheduler import FrameScheduler
 
-face_detector = dlib.get_frontal_face_detector()  # mraison here's where the magic happens
 cwd = os.path.abspath(os.path.dirname(__file__))
 model_path = os.path.abspath(os.path.join(cwd, "training_data_NEW/shape_predictor_68_face_landmarks.dat"))
 predictor = dlib.shape_predictor(model_path)
@@ -18,50 +22,43 @@ frame_size = (
     webcam.get(cv2.CAP_PROP_FRAME_WIDTH),
     webcam.get(cv2.CAP_PROP_FRAME_HEIGHT)
 )
-prev_landmarks=None
-while True:
-    # We get a new frame from the webcam
-    _, frame = webcam.read()
+# Every face gets its own session, with its own landmark filter
+sessions = MultiFaceSession(frame_size, landmark_filter=partial(OneEuroFilter, min_cutoff=1.0, beta=0.05))
+# All the faces are annotated in a handful of draw calls
+renderer = AnnotationRenderer()
 
-    # random drop
-    if np.random.randint(10) in [0, 1, 3]:
-        continue
 
-    try:
-        faces = face_detector(frame)
-        landmarks = predictor(frame, faces[0])
-    except:
-        landmarks = None
+def analysis():
+    """Builds the frame analysis of the pipeline worker"""
+    face_locator = FaceLocator(predictor, detection_scale=0.5, upsample_on_miss=True)  # mraison here's where the magic happens
+    # Frames that would come out late get a lighter analysis, or none at all
+    scheduler = FrameScheduler(target_fps=webcam.get(cv2.CAP_PROP_FPS) or 30.0)
 
-    use_prev = True
-    if landmarks and prev_landmarks:
-        neighborhood = 10
-        for i in Face.FEATURE_IDS_FOR_HEAD_TILT:
-            hypot = (
-                (landmarks.part(i).x - prev_landmarks.part(i).x) ** 2
-                + (landmarks.part(i).y - prev_landmarks.part(i).y) ** 2
-            ) ** (1 / 2)
-            if abs(hypot) - neighborhood > 0:
-                use_prev = False
+    def process(frame, timestamp=None):
+        _, faces = scheduler.schedule(
+            lambda: sessions.analyze(frame, face_locator.locate_all(frame), timestamp),
+            lambda: sessions.analyze(frame, face_locator.locate_all(frame), timestamp, degraded=True),
+            timestamp
+        )
+        return faces
 
-        if use_prev:
-            landmarks = prev_landmarks
-            for i in range(67):
-                prev_landmarks.part(i).x = (landmarks.part(i).x + prev_landmarks.part(i).x)/2
-                prev_landmarks.part(i).y = (landmarks.part(i).y + prev_landmarks.part(i).y)/2
+    return process
 
-    face = Face(frame, frame_size, landmarks)
-    face.analyze()
-    frame = face.annotate(frame)
-    frame = face.draw_vecs(frame)
 
-    k = cv2.waitKey(1)
-    if k == 27:
-        break
+# The webcam is read on its own thread and frames are dropped, oldest
+# first, whenever the analysis falls behind. A single worker keeps the
+# frames of each face in order for its filter, the faces of a frame are
+# analyzed in parallel by the session.
+with Pipeline(webcam, analysis, workers=1) as pipeline:
+    for result in pipeline.results():
+        frame = renderer.render(result.frame, list((result.result or {}).values()))
 
-    cv2.imshow("Demo", frame)
-    if not use_prev:
-        prev_landmarks = landmarks
+        k = cv2.waitKey(1)
+        if k == 27:
+            break
 
+        cv2.imshow("Demo", frame)
+
+sessions.close()
 webcam.release()
 cv2.destroyAllWindows()
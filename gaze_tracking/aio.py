@@ -0,0 +1,121 @@
+"""
+asyncio interface of the face tracking.
+
+The capture, the landmarks and the analysis all block, so they run in a
+thread pool and the event loop only awaits them. Each source is read one
+frame ahead of its analysis, and several sources can be streamed at once
+from the same tracker.
+
+    tracker = AsyncTracker(predictor)
+    async for result in tracker.stream(0):
+        print(result.frame_index, result.pupils)
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from .locator import FaceLocator
+from .result import FaceResult
+from .session import FaceSession
+
+
+class AsyncTracker(object):
+    """
+    This class streams the analysis of video sources to asyncio code. All
+    the blocking work goes to its thread pool, so the event loop is free to
+    serve other I/O while frames are processed.
+    """
+
+    def __init__(self, predictor, workers=4, scheduler=None, features=None, **locator_options):
+        """
+        Arguments:
+            predictor (dlib.shape_predictor): 68 points landmarks predictor, shared
+                by all the streams
+            workers (int): Number of threads of the blocking work, two are busy per
+                running stream
+            scheduler: Builds the scheduler.FrameScheduler of every stream, e.g.
+                functools.partial(FrameScheduler, target_fps=15). Every frame is
+                analyzed in full by default
+            features (tuple): Features to analyze, see Face.FEATURES
+            locator_options: Passed on to the FaceLocator of every stream
+        """
+        self.predictor = predictor
+        self.scheduler = scheduler
+        self.features = features
+        self.locator_options = locator_options
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stops the thread pool, the running streams must be over"""
+        self._executor.shutdown(wait=False)
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    @staticmethod
+    def _read(capture):
+        success, frame = capture.read()
+        return (time.time(), frame) if success else None
+
+    def _analyze(self, session, locator, frame_scheduler, frame, timestamp):
+        def analyze(degraded=False):
+            return session.analyze(
+                frame, locator.locate(frame), features=self.features, degraded=degraded
+            )
+
+        if frame_scheduler is None:
+            return analyze()
+        return frame_scheduler.schedule(analyze, lambda: analyze(True), timestamp)[1]
+
+    async def stream(self, source, session=None):
+        """Yields the result.FaceResult of every frame of a source, until the
+        source ends or the iteration is cancelled. Skipped frames (see
+        scheduler.FrameScheduler) give a result without a face.
+
+        Arguments:
+            source: Camera index, video file or stream URL, or an opened cv2.VideoCapture
+            session (session.FaceSession): Session of the face, a new one by default
+        """
+        own_capture = not hasattr(source, 'read')
+        capture = await self._run(cv2.VideoCapture, source) if own_capture else source
+        try:
+            if session is None:
+                dimensions = (
+                    capture.get(cv2.CAP_PROP_FRAME_WIDTH),
+                    capture.get(cv2.CAP_PROP_FRAME_HEIGHT)
+                )
+                session = FaceSession(dimensions)
+            locator = FaceLocator(self.predictor, **self.locator_options)
+            frame_scheduler = self.scheduler() if self.scheduler is not None else None
+
+            # the next frame is read while the current one is analyzed. The
+            # read is shielded: cancelling the stream must not mark it done
+            # while the pool thread is still inside capture.read()
+            reading = asyncio.ensure_future(self._run(self._read, capture))
+            index = 0
+            try:
+                while True:
+                    captured = await asyncio.shield(reading)
+                    if captured is None:
+                        break
+                    reading = asyncio.ensure_future(self._run(self._read, capture))
+
+                    timestamp, frame = captured
+                    face = await self._run(
+                        self._analyze, session, locator, frame_scheduler, frame, timestamp
+                    )
+                    yield FaceResult.from_face(face, index, timestamp)
+                    index += 1
+            finally:
+                # a read still running in the pool must be over before the release
+                if not reading.done():
+                    await asyncio.wait([reading])
+        finally:
+            if own_capture:
+                await self._run(capture.release)
@@ -10,6 +10,10 @@ class BaseFaceFeature(object):
         self.feature_reference_point = None
         self.vector = None
         self.vector_flat_projection = None
+        # When set, set_feature_reference_point only records the point and
+        # the vector is given later through set_vector (see Face.analyze,
+        # which back-projects the points of all the features together).
+        self.defer_vector = False
 
         self.display_box = [100,300]
         # direction to point the drawn flat vector.
@@ -29,7 +33,10 @@ class BaseFaceFeature(object):
             return
 
         self.feature_reference_point = point
-        start, end, dist = self.vect_calc.find_vector(point)
+        if not self.defer_vector:
+            self.set_vector(*self.vect_calc.find_vector(point))
+
+    def set_vector(self, start, end, dist):
         self.vector = {
             'start': start,
             'end': end,
@@ -42,7 +49,8 @@ class BaseFaceFeature(object):
             dtype='double'
         ).reshape(-1, 2)
 
-        hypot = self._scale * dist
+        # dist may come as a 1 element array
+        hypot = self._scale * float(np.ravel(dist)[0])
         if self._slope is None:
             flattened_end = np.array(
                 (flattened_start[0][0], flattened_start[0][1] + hypot),
@@ -0,0 +1,200 @@
+"""
+Offline analysis of recorded videos.
+
+The videos are split by file and by chunks of frames across a pool of
+processes. Every worker loads the shape predictor once, and the results
+of each video are written column by column to a .npz file, one column per
+field of result.RESULT.
+
+    python -m gaze_tracking.batch videos/ --model shape_predictor_68_face_landmarks.dat --output features/
+
+With --cache, the landmarks and pose of every frame are kept on disk (see
+cache.LandmarkCache) and the next runs over the same videos skip the face
+detection and landmark prediction.
+
+The .npz file of a video is named after it, videos of the same name in
+different directories get a hash of their path appended to tell them apart.
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import time
+import warnings
+import numpy as np
+import cv2
+import dlib
+from .cache import LandmarkCache, count_frames
+from .locator import FaceLocator
+from .result import RESULT, empty_results
+from .session import FaceSession
+
+VIDEO_EXTENSIONS = ('.avi', '.mkv', '.mov', '.mp4', '.webm')
+
+# Loaded once per worker process, see _init_worker
+_predictor = None
+
+
+def _init_worker(model_path):
+    global _predictor
+    _predictor = dlib.shape_predictor(model_path)
+
+
+def _process_chunk(task):
+    """Analyses the frames [start, stop) of a video in a worker process"""
+    path, start, stop, cache_path, locator_options = task
+    started = time.time()
+
+    capture = cv2.VideoCapture(path)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    frame_size = (
+        capture.get(cv2.CAP_PROP_FRAME_WIDTH),
+        capture.get(cv2.CAP_PROP_FRAME_HEIGHT)
+    )
+    session = FaceSession(frame_size)
+    locator = FaceLocator(_predictor, **locator_options)
+    # every chunk writes its own rows of the cache
+    cache = LandmarkCache(cache_path) if cache_path is not None else None
+
+    results = empty_results(stop - start)
+    nb_frames = 0
+    for row in range(stop - start):
+        success, frame = capture.read()
+        if not success:
+            break
+        index = start + row
+        if cache is not None and cache.is_cached(index):
+            landmarks, pose = cache.get(index)
+            face = session.analyze(frame, landmarks, pose=pose)
+        else:
+            face = session.analyze(frame, locator.locate(frame))
+            if cache is not None:
+                cache.put_face(index, face)
+        face.to_result(index, capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0).to_record(results[row])
+        nb_frames += 1
+    capture.release()
+    if cache is not None:
+        cache.flush()
+
+    return path, start, results[:nb_frames], nb_frames, time.time() - started, os.getpid()
+
+
+def find_videos(paths):
+    """Expands the directories of the given paths into the videos they contain"""
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            videos += sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(VIDEO_EXTENSIONS)
+            )
+        else:
+            videos.append(path)
+    return videos
+
+
+def output_names(videos):
+    """Returns the name of the .npz file of every video, the name of the video
+    unless another video has it too"""
+    names = [os.path.splitext(os.path.basename(path))[0] for path in videos]
+    return {
+        path: name if names.count(name) == 1 else "{}-{}".format(
+            name, hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+        )
+        for path, name in zip(videos, names)
+    }
+
+
+def _tasks(videos, chunk_size, cache_dir, locator_options):
+    for path in videos:
+        nb_frames = count_frames(path)
+        if not nb_frames:
+            warnings.warn("{} has no frames it can read, skipped".format(path))
+            continue
+        cache_path = None
+        if cache_dir is not None:
+            # created here, before the workers open it
+            cache = LandmarkCache.for_video(path, cache_dir, nb_frames)
+            cache_path = cache.path
+            del cache
+        for start in range(0, nb_frames, chunk_size):
+            yield path, start, min(start + chunk_size, nb_frames), cache_path, locator_options
+
+
+def process_videos(
+        paths,
+        model_path,
+        output_dir,
+        workers=None,
+        chunk_size=500,
+        cache_dir=None,
+        **locator_options
+):
+    """Analyses the given videos and writes one .npz file per video, see
+    output_names. Videos without any frame are skipped with a warning.
+
+    Every chunk of chunk_size frames is analysed independently, with its own
+    FaceSession, so the pupil calibration warms up again at each chunk.
+
+    Arguments:
+        paths (list): Videos, or directories of videos
+        model_path (str): Path of the 68 points shape predictor
+        output_dir (str): Directory of the .npz files
+        workers (int): Number of processes, defaults to the number of cores
+        chunk_size (int): Number of frames analysed by a task
+        cache_dir (str): Directory of the landmark caches, none are kept by default
+        locator_options: Passed on to FaceLocator
+
+    Returns:
+        Frames, seconds and frames per second of each worker
+    """
+    videos = find_videos(paths)
+    os.makedirs(output_dir, exist_ok=True)
+    names = output_names(videos)
+    chunks = {}
+    report = {}
+
+    tasks = list(_tasks(videos, chunk_size, cache_dir, locator_options))
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(model_path,)) as pool:
+        for path, start, results, nb_frames, seconds, pid in pool.imap_unordered(_process_chunk, tasks):
+            chunks.setdefault(path, []).append((start, results))
+            worker = report.setdefault(pid, {'frames': 0, 'seconds': 0.0})
+            worker['frames'] += nb_frames
+            worker['seconds'] += seconds
+
+    for path, video_chunks in chunks.items():
+        video_chunks.sort(key=lambda chunk: chunk[0])
+        results = np.concatenate([empty_results(0)] + [chunk for _, chunk in video_chunks])
+        np.savez(os.path.join(output_dir, names[path] + '.npz'), **{field: results[field] for field in RESULT.names})
+
+    for worker in report.values():
+        worker['fps'] = worker['frames'] / worker['seconds'] if worker['seconds'] else 0.0
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyses recorded videos with FacePuppet")
+    parser.add_argument('paths', nargs='+', help="videos, or directories of videos")
+    parser.add_argument('--model', required=True, help="path of the 68 points shape predictor")
+    parser.add_argument('--output', required=True, help="directory of the .npz files")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--detection-scale', type=float, default=1.0)
+    parser.add_argument('--cache', help="directory of the landmark caches")
+    args = parser.parse_args()
+
+    report = process_videos(
+        args.paths, args.model, args.output,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        cache_dir=args.cache,
+        detection_scale=args.detection_scale
+    )
+    for pid, worker in sorted(report.items()):
+        print("worker {}: {} frames in {:.1f}s, {:.1f} fps".format(
+            pid, worker['frames'], worker['seconds'], worker['fps']
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""
+On-disk cache of the landmarks and head pose of recorded videos.
+
+Detecting the face and predicting its landmarks is by far the slowest part
+of the analysis, and it doesn't depend on any of the thresholds of the
+features. The landmarks and pose of every frame are kept in a memory-mapped
+file, so the features can be analyzed again, e.g. after changing
+EyeBrow.RAISED_DISTANCE, without running dlib.
+
+    cache = LandmarkCache.for_video("video.mp4", "cache/")
+    for index, face in replay(cache, features=('brows', 'mouth')):
+        print(index, face.mouth.is_full_open())
+
+Only the eyes need the pixels of the frame, give replay the video for them.
+"""
+import hashlib
+import os
+import numpy as np
+import cv2
+from .face import Face
+from .landmarks import Landmarks
+from .session import FaceSession
+
+RECORD = np.dtype([
+    # the row was written, even if no face was found
+    ('cached', np.bool_),
+    ('located', np.bool_),
+    ('frame_hash', np.uint64),
+    ('landmarks', np.float32, (68, 2)),
+    ('rotation_vector', np.float64, (3,)),
+    ('translation_vector', np.float64, (3,)),
+])
+
+
+def video_key(path):
+    """Returns the name of the cache of a video, it changes with the video file"""
+    stat = os.stat(path)
+    digest = hashlib.sha1("{}:{}:{}".format(
+        os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+    ).encode()).hexdigest()
+    return "{}-{}".format(os.path.splitext(os.path.basename(path))[0], digest[:12])
+
+
+def count_frames(path):
+    """Returns the number of frames of a video. Containers that don't tell
+    (e.g. some webm files give 0) are read to the end"""
+    capture = cv2.VideoCapture(path)
+    nb_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    if nb_frames <= 0:
+        nb_frames = 0
+        while capture.grab():
+            nb_frames += 1
+    capture.release()
+    return nb_frames
+
+
+def frame_hash(frame):
+    """Returns a 64 bits hash of the content of a frame"""
+    digest = hashlib.blake2b(np.ascontiguousarray(frame).data, digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class LandmarkCache(object):
+    """
+    This class keeps the landmarks and head pose of every frame of a video
+    in a memory-mapped .npy file of RECORD rows, one per frame index. Rows
+    can also be looked up by the hash of the frame content.
+    """
+
+    def __init__(self, path, capacity=0, dimensions=None):
+        """
+        Arguments:
+            path (str): The .npy file, created if it doesn't exist
+            capacity (int): Number of rows of a new file, it grows when needed
+            dimensions (tuple): Dimensions of the frames, kept next to the file
+        """
+        self.path = path
+        self._hashes = None
+        if os.path.exists(path):
+            self.records = np.load(path, mmap_mode='r+')
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.records = self._create(path, capacity)
+
+        dimensions_path = self._dimensions_path()
+        if dimensions is not None:
+            np.save(dimensions_path, np.asarray(dimensions, dtype=np.float64))
+            self.dimensions = tuple(dimensions)
+        elif os.path.exists(dimensions_path):
+            self.dimensions = tuple(np.load(dimensions_path))
+        else:
+            self.dimensions = None
+
+    @classmethod
+    def for_video(cls, video_path, cache_dir, nb_frames=None):
+        """Returns the cache of a video, sized after its number of frames
+
+        Arguments:
+            video_path (str): The video
+            cache_dir (str): Directory of the caches
+            nb_frames (int): Number of frames of the video, counted by default
+        """
+        capture = cv2.VideoCapture(video_path)
+        dimensions = (
+            capture.get(cv2.CAP_PROP_FRAME_WIDTH),
+            capture.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        )
+        capture.release()
+        capacity = nb_frames if nb_frames is not None else count_frames(video_path)
+        cache = cls(os.path.join(cache_dir, video_key(video_path) + '.npy'), capacity, dimensions)
+        # a cache made while the frames weren't counted right is too short
+        if len(cache) < capacity:
+            cache._grow(capacity)
+        return cache
+
+    @staticmethod
+    def _create(path, capacity):
+        records = np.lib.format.open_memmap(path, mode='w+', dtype=RECORD, shape=(max(capacity, 1),))
+        records[:] = np.zeros((), RECORD)
+        return records
+
+    def _dimensions_path(self):
+        return os.path.splitext(self.path)[0] + '.dimensions.npy'
+
+    def __len__(self):
+        return len(self.records)
+
+    def _grow(self, capacity):
+        """Copies the rows into a bigger file"""
+        self.records.flush()
+        records = np.array(self.records)
+        del self.records
+        temporary = self.path + '.tmp.npy'
+        bigger = self._create(temporary, capacity)
+        bigger[:len(records)] = records
+        bigger.flush()
+        del bigger
+        os.replace(temporary, self.path)
+        self.records = np.load(self.path, mmap_mode='r+')
+
+    def put(self, index, landmarks, rotation_vector=None, translation_vector=None, frame=None):
+        """Stores the landmarks and pose of a frame.
+
+        Arguments:
+            index (int): Index of the frame in the video
+            landmarks (landmarks.Landmarks): Facial landmarks, None if no face was found
+            rotation_vector (numpy.ndarray): Head pose rotation
+            translation_vector (numpy.ndarray): Head pose translation
+            frame (numpy.ndarray): The frame, to look the row up by content later
+        """
+        if index >= len(self.records):
+            self._grow(max(index + 1, 2 * len(self.records)))
+
+        record = self.records[index]
+        record['cached'] = True
+        record['located'] = landmarks is not None and rotation_vector is not None
+        if record['located']:
+            record['landmarks'] = Landmarks.wrap(landmarks).points
+            record['rotation_vector'] = np.ravel(rotation_vector)
+            record['translation_vector'] = np.ravel(translation_vector)
+        if frame is not None:
+            record['frame_hash'] = frame_hash(frame)
+            if self._hashes is not None:
+                self._hashes[int(record['frame_hash'])] = index
+
+    def put_face(self, index, face, frame=None):
+        """Stores the landmarks and pose of an analyzed Face"""
+        if face.is_detected():
+            self.put(index, face.landmarks, face.rotational_vector, face.translation_vector, frame)
+        else:
+            self.put(index, None, frame=frame)
+
+    def is_cached(self, index):
+        return index < len(self.records) and bool(self.records['cached'][index])
+
+    def get(self, index):
+        """Returns the landmarks and the pose of a frame, both None if no face
+        was found in it.
+
+        Raises:
+            KeyError: The frame is not in the cache
+        """
+        if not self.is_cached(index):
+            raise KeyError(index)
+
+        record = self.records[index]
+        if not record['located']:
+            return None, None
+        pose = (
+            record['rotation_vector'].reshape(3, 1).copy(),
+            record['translation_vector'].reshape(3, 1).copy()
+        )
+        return Landmarks(record['landmarks'].copy()), pose
+
+    def find(self, frame):
+        """Returns the index of the row stored for a frame with the same content, or None"""
+        if self._hashes is None:
+            # built on first use, the hash of a row is never 0 unless the frame was missing
+            cached = np.flatnonzero(self.records['cached'] & (self.records['frame_hash'] != 0))
+            self._hashes = dict(zip(self.records['frame_hash'][cached].tolist(), cached.tolist()))
+        return self._hashes.get(frame_hash(frame))
+
+    def cached_indexes(self):
+        return np.flatnonzero(self.records['cached'])
+
+    def flush(self):
+        self.records.flush()
+
+
+def replay(cache, dimensions=None, video=None, features=None, session=None):
+    """Analyzes the features again from the cached landmarks and pose, without
+    detecting the faces or estimating the pose.
+
+    Arguments:
+        cache (LandmarkCache): Landmarks and pose of the frames
+        dimensions (tuple): Dimensions of the frames, the ones of the cache by default
+        video (str): The video, only read if the eyes are analyzed
+        features (tuple): Features to analyze, see Face.FEATURES. Brows and
+            mouth without a video, all of them with one
+        session (session.FaceSession): Carries the calibration from one frame to the next
+
+    Yields:
+        The index of every cached frame and its analyzed Face
+    """
+    if features is None:
+        features = Face.FEATURES if video is not None else ('brows', 'mouth')
+    if 'eyes' in features and video is None:
+        raise ValueError("The eyes can't be analyzed without the video")
+    if dimensions is None:
+        dimensions = cache.dimensions
+    if session is None:
+        session = FaceSession(dimensions)
+
+    capture = cv2.VideoCapture(video) if video is not None else None
+    position = 0
+    try:
+        for index in cache.cached_indexes():
+            index = int(index)
+            frame = None
+            if capture is not None:
+                if index != position:
+                    capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+                success, frame = capture.read()
+                position = index + 1
+                if not success:
+                    break
+
+            landmarks, pose = cache.get(index)
+            yield index, session.analyze(frame, landmarks, features=features, pose=pose)
+    finally:
+        if capture is not None:
+            capture.release()
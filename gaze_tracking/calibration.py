@@ -1,4 +1,9 @@
 from __future__ import division
+from collections import deque
+import json
+import os
+import time
+import numpy as np
 import cv2
 from .pupil import Pupil
 
@@ -9,25 +14,82 @@ class Calibration(object):
     best binarization threshold value for the person and the webcam.
     """
 
-    def __init__(self):
-        self.nb_frames = 20
-        self.thresholds_left = []
-        self.thresholds_right = []
+    # Share of the eye surface taken up by the iris once binarized
+    AVERAGE_IRIS_SIZE = 0.48
+
+    def __init__(self, threshold_step=5, recalibration_interval=None, nb_frames=20):
+        """
+        Arguments:
+            threshold_step (int): Gap between two tried thresholds
+            recalibration_interval (int): Once complete, one frame every that many
+                frames of each eye still goes to the calibration, the oldest
+                thresholds make room for it. Never by default
+            nb_frames (int): Number of frames the thresholds are averaged over
+        """
+        self.nb_frames = nb_frames
+        self.threshold_step = threshold_step
+        self.recalibration_interval = recalibration_interval
+        # Only the last nb_frames thresholds count
+        self.thresholds_left = deque(maxlen=nb_frames)
+        self.thresholds_right = deque(maxlen=nb_frames)
+        self._skipped = [0, 0]
 
     def is_complete(self):
         """Returns true if the calibration is completed"""
         return len(self.thresholds_left) >= self.nb_frames and len(self.thresholds_right) >= self.nb_frames
 
+    def wants_sample(self, side):
+        """Returns true if the frame of the given eye should go to evaluate,
+        always until the calibration is complete, then one frame every
+        recalibration_interval. Only one eye or the other is sampled on a
+        given frame, so a frame never pays for both.
+
+        Argument:
+            side: Indicates whether it's the left eye (0) or the right eye (1)
+        """
+        if not self.is_complete():
+            return True
+        if not self.recalibration_interval:
+            return False
+
+        self._skipped[side] += 1
+        # the right eye is half an interval behind the left one
+        offset = self.recalibration_interval // 2 if side == 1 else 0
+        if self._skipped[side] < self.recalibration_interval + offset:
+            return False
+        self._skipped[side] = offset
+        return True
+
     def threshold(self, side):
-        """Returns the threshold value for the given eye.
+        """Returns the threshold value for the given eye, None until the eye
+        had a frame to calibrate on.
 
         Argument:
             side: Indicates whether it's the left eye (0) or the right eye (1)
         """
-        if side == 0:
-            return int(sum(self.thresholds_left) / len(self.thresholds_left))
-        elif side == 1:
-            return int(sum(self.thresholds_right) / len(self.thresholds_right))
+        thresholds = self.thresholds_left if side == 0 else self.thresholds_right
+        if not thresholds:
+            return None
+        return int(sum(thresholds) / len(thresholds))
+
+    def to_profile(self):
+        """Returns the thresholds and settings of the calibration as a dict"""
+        return {
+            'nb_frames': self.nb_frames,
+            'threshold_step': self.threshold_step,
+            'thresholds_left': [int(threshold) for threshold in self.thresholds_left],
+            'thresholds_right': [int(threshold) for threshold in self.thresholds_right],
+        }
+
+    @classmethod
+    def from_profile(cls, profile, recalibration_interval=None):
+        """Builds a calibration from a dict of to_profile"""
+        calibration = cls(
+            profile['threshold_step'], recalibration_interval, nb_frames=profile['nb_frames']
+        )
+        calibration.thresholds_left.extend(profile['thresholds_left'])
+        calibration.thresholds_right.extend(profile['thresholds_right'])
+        return calibration
 
     @staticmethod
     def iris_size(frame):
@@ -44,22 +106,48 @@ class Calibration(object):
         return nb_blacks / nb_pixels
 
     @staticmethod
-    def find_best_threshold(eye_frame):
+    def iris_sizes(frame):
+        """Returns, for every threshold value (0 to 255), the percentage of
+        space that the iris would take up on the surface of the eye once
+        the frame is binarized with that threshold.
+
+        Argument:
+            frame (numpy.ndarray): Filtered iris frame, not binarized yet
+
+        Returns:
+            The percentages, or None if nothing is left of the frame inside
+            its 5 pixels border, e.g. a closed eye
+        """
+        frame = frame[5:-5, 5:-5]
+        if not frame.size:
+            return None
+        # A pixel turns black when its value is lower than or equal to the
+        # threshold, so the cumulative histogram counts the blacks for all
+        # thresholds at once.
+        histogram = np.bincount(frame.ravel(), minlength=256)
+        return np.cumsum(histogram) / frame.size
+
+    @staticmethod
+    def find_best_threshold(eye_frame, step=5):
         """Calculates the optimal threshold to binarize the
         frame for the given eye.
 
-        Argument:
+        Arguments:
             eye_frame (numpy.ndarray): Frame of the eye to be analyzed
+            step (int): Gap between two tried thresholds, 1 tries them all
+
+        Returns:
+            The threshold, or None if the frame is too small to tell
         """
-        average_iris_size = 0.48
-        trials = {}
+        thresholds = np.arange(5, 100, step)
 
-        for threshold in range(5, 100, 5):
-            iris_frame = Pupil.image_processing(eye_frame, threshold)
-            trials[threshold] = Calibration.iris_size(iris_frame)
+        iris_sizes = Calibration.iris_sizes(Pupil.filter_frame(eye_frame))
+        if iris_sizes is None:
+            return None
+        iris_sizes = iris_sizes[thresholds]
 
-        best_threshold, iris_size = min(trials.items(), key=(lambda p: abs(p[1] - average_iris_size)))
-        return best_threshold
+        best_threshold = thresholds[np.argmin(np.abs(iris_sizes - Calibration.AVERAGE_IRIS_SIZE))]
+        return int(best_threshold)
 
     def evaluate(self, eye_frame, side):
         """Improves calibration by taking into consideration the
@@ -69,9 +157,72 @@ class Calibration(object):
             eye_frame (numpy.ndarray): Frame of the eye
             side: Indicates whether it's the left eye (0) or the right eye (1)
         """
-        threshold = self.find_best_threshold(eye_frame)
+        threshold = self.find_best_threshold(eye_frame, self.threshold_step)
+        if threshold is None:
+            return
 
         if side == 0:
             self.thresholds_left.append(threshold)
         elif side == 1:
             self.thresholds_right.append(threshold)
+
+
+class CalibrationProfiles(object):
+    """
+    This class saves and loads calibrations as JSON files, one per user and
+    camera. A profile is only used for frames of the resolution it was made
+    with, the thresholds don't carry over to other eye sizes.
+    """
+
+    def __init__(self, directory):
+        """
+        Arguments:
+            directory (str): Directory of the profiles
+        """
+        self.directory = directory
+
+    def path(self, user_id, camera_id):
+        name = "{}@{}.json".format(user_id, camera_id)
+        # user and camera ids may come from anywhere
+        name = "".join(c if c.isalnum() or c in "@._-" else "_" for c in name)
+        return os.path.join(self.directory, name)
+
+    def load(self, user_id, camera_id, dimensions, recalibration_interval=None):
+        """Returns the calibration saved for the user and camera, or None if
+        there isn't any for these dimensions.
+
+        Arguments:
+            user_id (str): Identifies the user
+            camera_id (str): Identifies the camera
+            dimensions (tuple): Dimensions of the frames
+            recalibration_interval (int): See Calibration
+        """
+        try:
+            with open(self.path(user_id, camera_id)) as file:
+                profile = json.load(file)
+        except (IOError, ValueError):
+            return None
+        if tuple(profile.get('dimensions', ())) != tuple(float(d) for d in dimensions):
+            return None
+        return Calibration.from_profile(profile, recalibration_interval)
+
+    def save(self, calibration, user_id, camera_id, dimensions):
+        """Saves the calibration of the user and camera, if it is complete
+
+        Returns:
+            True if the calibration was saved
+        """
+        if not calibration.is_complete():
+            return False
+
+        profile = calibration.to_profile()
+        profile['dimensions'] = [float(d) for d in dimensions]
+        profile['saved'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(user_id, camera_id)
+        # written aside first, a crash never leaves half a profile
+        with open(path + '.tmp', 'w') as file:
+            json.dump(profile, file, indent=2)
+        os.replace(path + '.tmp', path)
+        return True
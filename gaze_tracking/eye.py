@@ -3,6 +3,7 @@ import numpy as np
 import cv2
 from .pupil import Pupil
 from .base import BaseFaceFeature
+from .metrics import NULL_METRICS
 
 
 class Eye(BaseFaceFeature):
@@ -14,7 +15,20 @@ class Eye(BaseFaceFeature):
     LEFT_EYE_POINTS = [36, 37, 38, 39, 40, 41]
     RIGHT_EYE_POINTS = [42, 43, 44, 45, 46, 47]
 
-    def __init__(self, original_frame, landmarks, side, calibration, vect_calc, dimension_calc):
+    # Width / height ratio over which the eye is closed
+    BLINKING_RATIO = 3.8
+
+    def __init__(
+            self,
+            original_frame,
+            landmarks,
+            side,
+            calibration,
+            vect_calc,
+            dimension_calc,
+            metrics=NULL_METRICS,
+            previous_pupil=None
+    ):
         super().__init__(vect_calc, dimension_calc)
         self._slope = -2 if side == 0 else 2
         self.x_coeff = 1 if side == 0 else -1
@@ -28,6 +42,9 @@ class Eye(BaseFaceFeature):
         self.landmarks = landmarks
         self.side = side
         self.calibration = calibration
+        self.metrics = metrics
+        # Pupil coordinates in the previous frame, if tracked
+        self.previous_pupil = previous_pupil
 
     def is_located(self):
         return self.pupils_located
@@ -53,39 +70,49 @@ class Eye(BaseFaceFeature):
         """Returns the middle point (x,y) between two points
 
         Arguments:
-            p1 (dlib.point): First point
-            p2 (dlib.point): Second point
+            p1 (numpy.ndarray): First point
+            p2 (numpy.ndarray): Second point
         """
-        x = int((p1.x + p2.x) / 2)
-        y = int((p1.y + p2.y) / 2)
+        x = int((p1[0] + p2[0]) / 2)
+        y = int((p1[1] + p2[1]) / 2)
         return (x, y)
 
     def _isolate(self, frame, landmarks, points):
         """Isolate an eye, to have a frame without other part of the face.
 
         Arguments:
-            frame (numpy.ndarray): Frame containing the face
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
+            frame (numpy.ndarray): Frame containing the face, grey or BGR
+            landmarks (landmarks.Landmarks): Facial landmarks for the face region
             points (list): Points of an eye (from the 68 Multi-PIE landmarks)
         """
-        region = np.array([(landmarks.part(point).x, landmarks.part(point).y) for point in points])
-        region = region.astype(np.int32)
+        region = landmarks[points].astype(np.int32)
 
-        # Applying a mask to get only the eye
+        # Cropping on the eye, clamped to the frame. An eye out of the frame
+        # gives an empty patch, and no eye frame.
+        margin = 5
         height, width = frame.shape[:2]
-        black_frame = np.zeros((height, width), np.uint8)
-        mask = np.full((height, width), 255, np.uint8)
-        cv2.fillPoly(mask, [region], (0, 0, 0))
-        eye = cv2.bitwise_not(black_frame, frame.copy(), mask=mask)
+        min_x = int(np.clip(np.min(region[:, 0]) - margin, 0, width))
+        max_x = int(np.clip(np.max(region[:, 0]) + margin, 0, width))
+        min_y = int(np.clip(np.min(region[:, 1]) - margin, 0, height))
+        max_y = int(np.clip(np.max(region[:, 1]) + margin, 0, height))
+        if min_x >= max_x or min_y >= max_y:
+            self.frame = None
+            self.origin = None
+            self.center = None
+            return
 
-        # Cropping on the eye
-        margin = 5
-        min_x = np.min(region[:, 0]) - margin
-        max_x = np.max(region[:, 0]) + margin
-        min_y = np.min(region[:, 1]) - margin
-        max_y = np.max(region[:, 1]) + margin
+        # Applying a mask to get only the eye. Everything is done on the
+        # cropped patch, with the polygon shifted into its coordinates.
+        eye = frame[min_y:max_y, min_x:max_x]
+        if eye.ndim == 3:
+            eye = cv2.cvtColor(eye, cv2.COLOR_BGR2GRAY)
+        else:
+            eye = eye.copy()
+        mask = np.zeros(eye.shape[:2], np.uint8)
+        cv2.fillPoly(mask, [(region - (min_x, min_y)).astype(np.int32)], 255)
+        eye[mask == 0] = 255
 
-        self.frame = eye[min_y:max_y, min_x:max_x]
+        self.frame = eye
         self.origin = (min_x, min_y)
 
         height, width = self.frame.shape[:2]
@@ -96,16 +123,16 @@ class Eye(BaseFaceFeature):
         It's the division of the width of the eye, by its height.
 
         Arguments:
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
+            landmarks (landmarks.Landmarks): Facial landmarks for the face region
             points (list): Points of an eye (from the 68 Multi-PIE landmarks)
 
         Returns:
             The computed ratio
         """
-        left = (landmarks.part(points[0]).x, landmarks.part(points[0]).y)
-        right = (landmarks.part(points[3]).x, landmarks.part(points[3]).y)
-        top = self._middle_point(landmarks.part(points[1]), landmarks.part(points[2]))
-        bottom = self._middle_point(landmarks.part(points[5]), landmarks.part(points[4]))
+        left = landmarks[points[0]]
+        right = landmarks[points[3]]
+        top = self._middle_point(landmarks[points[1]], landmarks[points[2]])
+        bottom = self._middle_point(landmarks[points[5]], landmarks[points[4]])
 
         eye_width = math.hypot((left[0] - right[0]), (left[1] - right[1]))
         eye_height = math.hypot((top[0] - bottom[0]), (top[1] - bottom[1]))
@@ -118,9 +145,9 @@ class Eye(BaseFaceFeature):
         return ratio
 
     def is_blinking(self):
-        """Returns true if the user closes his eyes"""
-        if self.pupils_located:
-            return self.blinking > 3.8
+        """Returns true if the user closes his eyes, None if unknown"""
+        if self.pupils_located and self.blinking is not None:
+            return self.blinking > self.BLINKING_RATIO
 
     def analyze(self):
         if self.landmarks is None:
@@ -137,7 +164,7 @@ class Eye(BaseFaceFeature):
 
         Arguments:
             original_frame (numpy.ndarray): Frame passed by the user
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
+            landmarks (landmarks.Landmarks): Facial landmarks for the face region
             side: Indicates whether it's the left eye (0) or the right eye (1)
             calibration (calibration.Calibration): Manages the binarization threshold value
         """
@@ -150,12 +177,33 @@ class Eye(BaseFaceFeature):
 
         self.blinking = self._blinking_ratio(landmarks, points)
         self._isolate(original_frame, landmarks, points)
+        # nothing of the eye in the frame, or no threshold yet (the eye
+        # patches so far were too thin to calibrate on)
+        threshold = None
+        if self.frame is not None:
+            if calibration.wants_sample(side):
+                with self.metrics.timer('calibration'):
+                    calibration.evaluate(self.frame, side)
+                self.metrics.count('calibration_frames')
+            threshold = calibration.threshold(side)
+        if threshold is None:
+            self.pupil = None
+            self.metrics.count('pupil_misses')
+            self.set_feature_reference_point(None)
+            return
 
-        if not calibration.is_complete():
-            calibration.evaluate(self.frame, side)
-
-        threshold = calibration.threshold(side)
-        self.pupil = Pupil(self.frame, threshold)
+        previous = None
+        if self.previous_pupil is not None:
+            previous = (
+                self.previous_pupil[0] - self.origin[0],
+                self.previous_pupil[1] - self.origin[1]
+            )
+        with self.metrics.timer('pupil'):
+            self.pupil = Pupil(self.frame, threshold, previous)
+        if self.pupil.tracked:
+            self.metrics.count('pupils_tracked')
+        if not self.pupils_located:
+            self.metrics.count('pupil_misses')
         self.set_feature_reference_point(self.pupil_coords())
 
     def annotated_frame(self, frame):
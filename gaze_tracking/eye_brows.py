@@ -17,6 +17,10 @@ class EyeBrow(BaseFaceFeature):
 
     BRIDGE_OF_NOSE = [27]
 
+    # Distances (pixels) between the middle of the brow and the top eyelid
+    RAISED_DISTANCE = 35
+    FURROWED_DISTANCE = 28
+
     def __init__(self, landmarks, side, vect_calc, dimension_calc):
         super().__init__(vect_calc, dimension_calc)
         self._slope = -1 if side == 0 else 1
@@ -33,24 +37,25 @@ class EyeBrow(BaseFaceFeature):
 
     def is_raised(self):
         if self.distance_from_nose:
-            return self.distance_from_nose > 35
+            return self.distance_from_nose > self.RAISED_DISTANCE
         return False
 
     def is_neutral(self):
         if self.distance_from_nose:
-            return 28 < self.distance_from_nose <= 35
+            return self.FURROWED_DISTANCE < self.distance_from_nose <= self.RAISED_DISTANCE
         return False
 
     def is_furrowed(self):
         if self.distance_from_nose:
-            return self.distance_from_nose <= 28
+            return self.distance_from_nose <= self.FURROWED_DISTANCE
         return False
 
     def _position(self, landmarks, brow_points, nose_bridge):
-        middle_point = (landmarks.part(brow_points[2]).x, landmarks.part(brow_points[2]).y)
+        x, y = landmarks[brow_points[2]]
+        middle_point = (int(x), int(y))
 
         self.distance_from_nose = np.abs(
-            middle_point[1] - landmarks.part(nose_bridge[0]).y
+            middle_point[1] - landmarks[nose_bridge[0]][1]
         )
 
         return middle_point
@@ -68,7 +73,7 @@ class EyeBrow(BaseFaceFeature):
 
         Arguments:
             original_frame (numpy.ndarray): Frame passed by the user
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
+            landmarks (landmarks.Landmarks): Facial landmarks for the face region
             side: Indicates whether it's the left eye (0) or the right eye (1)
             calibration (calibration.Calibration): Manages the binarization threshold value
         """
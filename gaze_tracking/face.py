@@ -4,8 +4,10 @@ from .eye import Eye
 from .calibration import Calibration
 from .eye_brows import EyeBrow
 from .mouth import Mouth
-from .utils.calculators import FeatureVectorFinder, ThreeDimensionalCalc
-from imutils import face_utils
+from .landmarks import Landmarks
+from .metrics import NULL_METRICS
+from .result import FaceResult
+from .utils.calculators import CameraProjection, FeatureVectorFinder, ThreeDimensionalCalc
 
 ##################
 # https://stackoverflow.com/questions/12299870/computing-x-y-coordinate-3d-from-image-point
@@ -32,6 +34,8 @@ class CameraSpecs(object):
              [0, 0, 1]], dtype="double"
         )
 
+        self.projection = CameraProjection.for_camera(self.camera_matrix, dimensions)
+
         # Not sure what these are but they were values commonly floating around.
         self.r_vec = np.array([[0.01891013], [0.08560084], [-3.14392813]])
         self.t_vec = np.array(
@@ -60,20 +64,49 @@ class Face(object):
 
     DIST_COEFFS = np.zeros((4, 1))  # Assuming no lens distortion
 
-    def __init__(self, frame, dimensions, landmarks):
+    # 3D box drawn as annotation of the pose, rear square then front square
+    ANNOTATION_BOX_POINTS = np.array([
+        (-75, -75, 0), (-75, 75, 0), (75, 75, 0), (75, -75, 0), (-75, -75, 0),
+        (-100, -100, 100), (-100, 100, 100), (100, 100, 100), (100, -100, 100), (-100, -100, 100)
+    ], dtype=np.float32)
+
+    # Features analyzed on top of the head pose
+    FEATURES = ('brows', 'eyes', 'mouth')
+
+    def __init__(self, frame, dimensions, landmarks, session=None, greyframe=None, features=None, pose=None):
         self.frame = frame
-        self.greyframe = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
+        # The grey frame is only computed if someone asks for it, the eyes
+        # convert their own small patch otherwise. It can also be shared
+        # by all the faces of a frame.
+        self._greyframe = greyframe
+        # Only these features are built and analyzed, all of them by default
+        self.requested_features = self.FEATURES if features is None else tuple(features)
+        # Rotation and translation vectors already known for these landmarks,
+        # e.g. replayed from a cache.LandmarkCache, solvePnP is skipped
+        self.pose = pose
 
-        self.calibration = Calibration()
-        # Camera internals
-        self.camera_specs = CameraSpecs(dimensions)
+        # A session (see session.FaceSession) carries the calibration and camera
+        # internals from one frame to the next. Without one, everything is
+        # rebuilt and the calibration never gets past its first frame.
+        self.session = session
+        if session is not None:
+            self.calibration = session.calibration
+            self.camera_specs = session.camera_specs
+            self.metrics = session.metrics
+        else:
+            self.calibration = Calibration()
+            # Camera internals
+            self.camera_specs = CameraSpecs(dimensions)
+            self.metrics = NULL_METRICS
 
         # features
         self.brows = None
         self.eyes = None
         self.mouth = None
 
-        self.landmarks = landmarks
+        # Accepts the dlib predictor output as well, every feature reads
+        # the points from the same (68, 2) array.
+        self.landmarks = Landmarks.wrap(landmarks)
 
         self.face_shape = None
         # These will inform us how to adjust the analysis of all other parts of the face.
@@ -82,32 +115,56 @@ class Face(object):
         self.vect_calc = None
         self.dimension_calc = None
 
+    @property
+    def greyframe(self):
+        if self._greyframe is None:
+            self._greyframe = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
+        return self._greyframe
+
     def all_located(self):
-        if (
-            self.brows is not None
-                and self.eyes is not None
-                and self.mouth is not None
-        ):
-            return (
-                self.brows[0].is_located()
-                and self.brows[1].is_located()
-                and self.eyes[0].is_located()
-                and self.eyes[1].is_located()
-                and self.mouth.is_located()
-            )
+        features = self.features()
+        if len(features) > 0:
+            return all(feature.is_located() for feature in features)
         else:
             return False
 
+    def features(self):
+        """Returns the loaded features, brows first, then eyes and mouth"""
+        features = []
+        if self.brows is not None:
+            features += self.brows
+        if self.eyes is not None:
+            features += self.eyes
+        if self.mouth is not None:
+            features.append(self.mouth)
+        return features
+
     def load_features(self):
-        self.brows = (
-            EyeBrow(self.landmarks, 0, self.vect_calc, self.dimension_calc),
-            EyeBrow(self.landmarks, 1, self.vect_calc, self.dimension_calc)
-        )
-        self.eyes = (
-            Eye(self.greyframe, self.landmarks, 0, self.calibration, self.vect_calc, self.dimension_calc),
-            Eye(self.greyframe, self.landmarks, 1, self.calibration, self.vect_calc, self.dimension_calc)
-        )
-        self.mouth = Mouth(self.landmarks, self.vect_calc, self.dimension_calc)
+        if 'brows' in self.requested_features:
+            self.brows = (
+                EyeBrow(self.landmarks, 0, self.vect_calc, self.dimension_calc),
+                EyeBrow(self.landmarks, 1, self.vect_calc, self.dimension_calc)
+            )
+        if 'eyes' in self.requested_features:
+            # the colour frame will do, only the eye patches get converted
+            frame = self._greyframe if self._greyframe is not None else self.frame
+            pupils = self.session.pupils if self.session is not None else {}
+            self.eyes = tuple(
+                Eye(
+                    frame, self.landmarks, side, self.calibration, self.vect_calc, self.dimension_calc,
+                    self.metrics, pupils.get(side)
+                )
+                for side in (0, 1)
+            )
+        if 'mouth' in self.requested_features:
+            self.mouth = Mouth(self.landmarks, self.vect_calc, self.dimension_calc)
+        for feature in self.features():
+            feature.defer_vector = True
+
+    def to_result(self, frame_index=0, timestamp=None):
+        """Returns the analysis as a result.FaceResult, which holds no frame
+        and can be kept around or stacked into arrays"""
+        return FaceResult.from_face(self, frame_index, timestamp)
 
     def is_detected(self):
         if self.rotational_vector is None or self.translation_vector is None:
@@ -121,117 +178,165 @@ class Face(object):
             self.translation_vector = None
             self.dimension_calc = None
             self.vect_calc = None
+            if self.session is not None:
+                # tracking lost, the next pose and pupils start from scratch
+                self.session.reset_tracking()
             return
 
-        self._analyze()
+        metrics = self.metrics
+        with metrics.timer('pose'):
+            self._analyze()
         self.load_features()
         # now analyze each individual feature.
-        self.brows[0].analyze()
-        self.brows[1].analyze()
-        self.eyes[0].analyze()
-        self.eyes[1].analyze()
-        self.mouth.analyze()
+        if self.brows is not None:
+            with metrics.timer('brows'):
+                self.brows[0].analyze()
+                self.brows[1].analyze()
+        if self.eyes is not None:
+            with metrics.timer('eyes'):
+                self.eyes[0].analyze()
+                self.eyes[1].analyze()
+            if self.session is not None:
+                self.session.update_pupils(self.eyes)
+        if self.mouth is not None:
+            with metrics.timer('mouth'):
+                self.mouth.analyze()
+        with metrics.timer('vectors'):
+            self._find_vectors()
 
-    def _analyze(self):
-        # grab the face shape...sort of unrelated to the rest of this function...
-        self.face_shape = face_utils.shape_to_np(self.landmarks)
+    def _find_vectors(self):
+        """Back-projects the reference points of all the located features in one go"""
+        located = [
+            feature for feature in self.features() if feature.feature_reference_point is not None
+        ]
+        if not located:
+            return
 
-        image_points = np.array(
-            [
-                (self.landmarks.part(pt).x, self.landmarks.part(pt).y) for pt in self.FEATURE_IDS_FOR_HEAD_TILT
-            ], dtype=np.float32
+        vectors = self.vect_calc.find_vectors(
+            [feature.feature_reference_point for feature in located]
         )
+        for feature, vector in zip(located, vectors):
+            feature.set_vector(*vector)
 
-        (success, rotation_vector, translation_vector) = cv2.solvePnP(
-            self.MODEL_POINTS, image_points, self.camera_specs.camera_matrix,
-            self.DIST_COEFFS, rvec=self.camera_specs.r_vec, tvec=self.camera_specs.t_vec,
-            flags=cv2.SOLVEPNP_ITERATIVE,
-            useExtrinsicGuess=False
-        )
+    def _analyze(self):
+        # grab the face shape...sort of unrelated to the rest of this function...
+        self.face_shape = self.landmarks.points.astype(np.int32)
+
+        if self.pose is not None:
+            rotation_vector, translation_vector = self.pose
+        else:
+            image_points = self.landmarks[self.FEATURE_IDS_FOR_HEAD_TILT].astype(np.float32)
+            rotation_vector, translation_vector = self._solve_pose(image_points)
         self.rotational_vector = rotation_vector
         self.translation_vector = translation_vector
         self.dimension_calc = ThreeDimensionalCalc(
             self.rotational_vector,
             self.translation_vector,
             self.camera_specs.camera_matrix,
-            self.camera_specs.dimensions
+            self.camera_specs.dimensions,
+            projection=self.camera_specs.projection
         )
         self.vect_calc = FeatureVectorFinder(
             self.landmarks,
             self.dimension_calc
         )
 
+    def _solve_pose(self, image_points):
+        """Estimates the head pose. With a session, the last good pose seeds
+        solvePnP, and a small motion only gets a few refinement iterations.
+
+        Argument:
+            image_points (numpy.ndarray): Image points of FEATURE_IDS_FOR_HEAD_TILT
+
+        Returns:
+            The rotation and translation vectors
+        """
+        session = self.session
+        if session is None or not session.has_pose():
+            # solvePnP writes into the given vectors, never hand it the constants.
+            (success, rotation_vector, translation_vector) = cv2.solvePnP(
+                self.MODEL_POINTS, image_points, self.camera_specs.camera_matrix,
+                self.DIST_COEFFS, rvec=self.camera_specs.r_vec.copy(), tvec=self.camera_specs.t_vec.copy(),
+                flags=cv2.SOLVEPNP_ITERATIVE,
+                useExtrinsicGuess=False
+            )
+        elif session.is_small_motion(image_points):
+            success = True
+            rotation_vector, translation_vector = cv2.solvePnPRefineLM(
+                self.MODEL_POINTS, image_points, self.camera_specs.camera_matrix,
+                self.DIST_COEFFS, session.rotation_vector.copy(), session.translation_vector.copy(),
+                criteria=session.refine_criteria
+            )
+        else:
+            (success, rotation_vector, translation_vector) = cv2.solvePnP(
+                self.MODEL_POINTS, image_points, self.camera_specs.camera_matrix,
+                self.DIST_COEFFS, rvec=session.rotation_vector.copy(), tvec=session.translation_vector.copy(),
+                flags=cv2.SOLVEPNP_ITERATIVE,
+                useExtrinsicGuess=True
+            )
+
+        if session is not None:
+            # A face behind the camera means the solver diverged.
+            if success and translation_vector[2, 0] > 0:
+                session.update_pose(rotation_vector, translation_vector, image_points)
+            else:
+                session.reset_pose()
+
+        return rotation_vector, translation_vector
+
     def draw_annotation_box(
         self,
         image,
         color=(0, 255, 0),
         line_width=2
     ):
+        """Draw a 3D box as annotation of pose"""
         if not self.is_detected():
             return image
-        """Draw a 3D box as annotation of pose"""
-        point_3d = []
-        rear_size = 75
-        rear_depth = 0
-        point_3d.append((-rear_size, -rear_size, rear_depth))
-        point_3d.append((-rear_size, rear_size, rear_depth))
-        point_3d.append((rear_size, rear_size, rear_depth))
-        point_3d.append((rear_size, -rear_size, rear_depth))
-        point_3d.append((-rear_size, -rear_size, rear_depth))
-
-        front_size = 100
-        front_depth = 100
-        point_3d.append((-front_size, -front_size, front_depth))
-        point_3d.append((-front_size, front_size, front_depth))
-        point_3d.append((front_size, front_size, front_depth))
-        point_3d.append((front_size, -front_size, front_depth))
-        point_3d.append((-front_size, -front_size, front_depth))
-        point_3d = np.array(point_3d, dtype=np.float32).reshape(-1, 3)
 
+        point_2d = self.annotation_box()
+
+        # Draw all the lines
+        cv2.polylines(image, [point_2d], True, color, line_width, cv2.LINE_AA)
+        cv2.polylines(image, [point_2d[[1, 6]], point_2d[[2, 7]], point_2d[[3, 8]]],
+                      False, color, line_width, cv2.LINE_AA)
+        return image
+
+    def annotation_box(self):
+        """Returns the 2d image points of the annotation box"""
         # Map to 2d image points
-        (point_2d, _) = cv2.projectPoints(point_3d,
+        (point_2d, _) = cv2.projectPoints(self.ANNOTATION_BOX_POINTS,
                                           self.rotational_vector,
                                           self.translation_vector,
                                           self.camera_specs.camera_matrix,
                                           self.DIST_COEFFS)
-        point_2d = np.int32(point_2d.reshape(-1, 2))
-
-        # Draw all the lines
-        cv2.polylines(image, [point_2d], True, color, line_width, cv2.LINE_AA)
-        cv2.line(image, tuple(point_2d[1]), tuple(
-            point_2d[6]), color, line_width, cv2.LINE_AA)
-        cv2.line(image, tuple(point_2d[2]), tuple(
-            point_2d[7]), color, line_width, cv2.LINE_AA)
-        cv2.line(image, tuple(point_2d[3]), tuple(
-            point_2d[8]), color, line_width, cv2.LINE_AA)
-        return image
+        return np.int32(point_2d.reshape(-1, 2))
 
     def annotated_face_shape(self, frame):
-        """Returns the main frame with pupils highlighted"""
-        # frame = self.frame.copy()
+        """Returns the main frame with the landmarks highlighted"""
         if self.face_shape is not None and self.face_shape.any():
-            for (x, y) in self.face_shape:
-                cv2.circle(frame, (x, y), 2, (0, 255, 0), -1)
+            # A zero length segment 4 pixels thick is the same dot as a
+            # circle of radius 2, and all of them go in a single call.
+            dots = np.repeat(self.face_shape[:, None, :], 2, axis=1)
+            cv2.polylines(frame, list(dots), False, (0, 255, 0), 4)
         return frame
 
     def annotate(self, frame):
+        with self.metrics.timer('annotation'):
+            return self._annotate(frame)
+
+    def _annotate(self, frame):
         try:
             frame = self.draw_annotation_box(frame)
             frame = self.annotated_face_shape(frame)
-            frame = self.brows[0].annotated_frame(frame)
-            frame = self.brows[1].annotated_frame(frame)
-            frame = self.eyes[0].annotated_frame(frame)
-            frame = self.eyes[1].annotated_frame(frame)
-            frame = self.mouth.annotated_frame(frame)
+            for feature in self.features():
+                frame = feature.annotated_frame(frame)
             return frame
         except:
             return frame
 
     def draw_vecs(self, frame):
         if self.all_located():
-            frame = self.brows[0].draw_vect(frame)
-            frame = self.brows[1].draw_vect(frame)
-            frame = self.eyes[0].draw_vect(frame)
-            frame = self.eyes[1].draw_vect(frame)
-            frame = self.mouth.draw_vect(frame)
+            for feature in self.features():
+                frame = feature.draw_vect(frame)
         return frame
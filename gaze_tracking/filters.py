@@ -0,0 +1,142 @@
+import math
+import numpy as np
+
+
+class OneEuroFilter(object):
+    """
+    One Euro filter (Casiez et al. 2012) applied to all the landmarks at
+    once. Slow moves are smoothed a lot, fast moves barely lagged.
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=0.05, derivate_cutoff=1.0, frequency=30.0):
+        """
+        Arguments:
+            min_cutoff (float): Cutoff frequency (Hz) when the landmarks don't move,
+                lower means smoother
+            beta (float): How much the cutoff goes up with the speed, higher means less lag
+            derivate_cutoff (float): Cutoff frequency (Hz) of the speed estimation
+            frequency (float): Frame rate assumed when no timestamp is given
+        """
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.derivate_cutoff = derivate_cutoff
+        self.frequency = frequency
+        self.reset()
+
+    def reset(self):
+        self._points = None
+        self._derivate = None
+        self._timestamp = None
+
+    @staticmethod
+    def _alpha(cutoff, period):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / period)
+
+    def _period(self, timestamp):
+        if timestamp is None or self._timestamp is None or timestamp <= self._timestamp:
+            return 1.0 / self.frequency
+        return timestamp - self._timestamp
+
+    def __call__(self, points, timestamp=None):
+        """Filters the landmarks of a new frame.
+
+        Arguments:
+            points (numpy.ndarray): (N, 2) landmarks
+            timestamp (float): Time of the frame in seconds
+
+        Returns:
+            The filtered (N, 2) landmarks
+        """
+        points = np.asarray(points, dtype=np.float64)
+        if self._points is None:
+            self._points = points.copy()
+            self._derivate = np.zeros_like(points)
+            self._timestamp = timestamp
+            return self._points.copy()
+
+        period = self._period(timestamp)
+        self._timestamp = timestamp
+
+        derivate = (points - self._points) / period
+        alpha = self._alpha(self.derivate_cutoff, period)
+        self._derivate += alpha * (derivate - self._derivate)
+
+        # one cutoff per landmark, from its speed
+        speed = np.linalg.norm(self._derivate, axis=1, keepdims=True)
+        tau = 1.0 / (2 * math.pi * (self.min_cutoff + self.beta * speed))
+        alpha = 1.0 / (1.0 + tau / period)
+        self._points += alpha * (points - self._points)
+        return self._points.copy()
+
+
+class KalmanFilter(object):
+    """
+    Constant velocity Kalman filter applied to all the landmarks at once.
+    Every coordinate follows the same model with the same noises, so they
+    all share a single 2x2 covariance and the update is a few array
+    operations.
+    """
+
+    def __init__(self, process_noise=500.0, measurement_noise=4.0, frequency=30.0):
+        """
+        Arguments:
+            process_noise (float): Variance of the acceleration (pixels/s^2)^2,
+                higher means less lag
+            measurement_noise (float): Variance of the landmarks (pixels^2),
+                higher means smoother
+            frequency (float): Frame rate assumed when no timestamp is given
+        """
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.frequency = frequency
+        self.reset()
+
+    def reset(self):
+        self._points = None
+        self._velocity = None
+        self._covariance = None
+        self._timestamp = None
+
+    def _period(self, timestamp):
+        if timestamp is None or self._timestamp is None or timestamp <= self._timestamp:
+            return 1.0 / self.frequency
+        return timestamp - self._timestamp
+
+    def __call__(self, points, timestamp=None):
+        """Filters the landmarks of a new frame.
+
+        Arguments:
+            points (numpy.ndarray): (N, 2) landmarks
+            timestamp (float): Time of the frame in seconds
+
+        Returns:
+            The filtered (N, 2) landmarks
+        """
+        points = np.asarray(points, dtype=np.float64)
+        if self._points is None:
+            self._points = points.copy()
+            self._velocity = np.zeros_like(points)
+            self._covariance = np.diag([self.measurement_noise, self.process_noise])
+            self._timestamp = timestamp
+            return self._points.copy()
+
+        period = self._period(timestamp)
+        self._timestamp = timestamp
+
+        # predict
+        transition = np.array([[1.0, period], [0.0, 1.0]])
+        noise = self.process_noise * np.array([
+            [period ** 4 / 4, period ** 3 / 2],
+            [period ** 3 / 2, period ** 2]
+        ])
+        self._points += self._velocity * period
+        covariance = transition.dot(self._covariance).dot(transition.T) + noise
+
+        # update, only the positions are measured
+        gain = covariance[:, 0] / (covariance[0, 0] + self.measurement_noise)
+        innovation = points - self._points
+        self._points += gain[0] * innovation
+        self._velocity += gain[1] * innovation
+        self._covariance = covariance - np.outer(gain, covariance[0])
+        return self._points.copy()
@@ -0,0 +1,73 @@
+from collections import namedtuple
+import numpy as np
+
+
+Point = namedtuple('Point', ['x', 'y'])
+
+
+def bounds_overlap(bounds1, bounds2):
+    """Returns the intersection over union of two bounding boxes (left, top, right, bottom)"""
+    width = min(bounds1[2], bounds2[2]) - max(bounds1[0], bounds2[0])
+    height = min(bounds1[3], bounds2[3]) - max(bounds1[1], bounds2[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+
+    intersection = width * height
+    area1 = (bounds1[2] - bounds1[0]) * (bounds1[3] - bounds1[1])
+    area2 = (bounds2[2] - bounds2[0]) * (bounds2[3] - bounds2[1])
+    return intersection / (area1 + area2 - intersection)
+
+
+class Landmarks(object):
+    """
+    This class holds the 68 facial landmarks of a face in a single (68, 2)
+    array. It is built once per frame and shared by every feature, which
+    slices it with the index lists of their points.
+    """
+
+    NB_POINTS = 68
+
+    def __init__(self, points):
+        self.points = np.asarray(points).reshape(-1, 2)
+
+    @classmethod
+    def from_dlib(cls, shape):
+        """Converts the output of the dlib shape predictor.
+
+        Argument:
+            shape (dlib.full_object_detection): Facial landmarks for the face region
+        """
+        return cls(np.array([(point.x, point.y) for point in shape.parts()], dtype=np.int32))
+
+    @classmethod
+    def wrap(cls, landmarks):
+        """Returns the given landmarks as a Landmarks object.
+
+        Argument:
+            landmarks: Landmarks, (68, 2) array, dlib.full_object_detection or None
+        """
+        if landmarks is None or isinstance(landmarks, cls):
+            return landmarks
+        if isinstance(landmarks, np.ndarray):
+            return cls(landmarks)
+        return cls.from_dlib(landmarks)
+
+    def __getitem__(self, index):
+        return self.points[index]
+
+    def __len__(self):
+        return len(self.points)
+
+    def part(self, index):
+        """Returns a single point, like dlib.full_object_detection.part"""
+        return Point(*self.points[index])
+
+    def parts(self):
+        """Returns all the points, like dlib.full_object_detection.parts"""
+        return [Point(*point) for point in self.points]
+
+    def bounds(self):
+        """Returns the bounding box (left, top, right, bottom) of the landmarks"""
+        left, top = self.points.min(axis=0)
+        right, bottom = self.points.max(axis=0)
+        return (left, top, right, bottom)
@@ -0,0 +1,223 @@
+import cv2
+import dlib
+from .landmarks import Landmarks, bounds_overlap
+from .metrics import NULL_METRICS
+
+
+class FaceLocator(object):
+    """
+    This class finds the facial landmarks in a frame. The dlib HOG detector
+    only runs every few frames, in between the face rectangles are derived
+    from the landmarks of the previous frame. A full detection is run again
+    as soon as one of the tracked faces is lost.
+
+    The predictor returns face-shaped landmarks for any rectangle, so a
+    tracked face is also checked by running the detector on a small image
+    of its surroundings, scaled so that the face is VERIFY_FACE_SIZE wide.
+    """
+
+    # Width of the faces, in pixels, in the images of the tracking check
+    VERIFY_FACE_SIZE = 120
+    # Margin around the face in these images, relative to the face size
+    VERIFY_MARGIN = 0.5
+
+    def __init__(
+            self,
+            predictor,
+            detector=None,
+            detect_every=10,
+            margin=0.15,
+            min_overlap=0.5,
+            detection_scale=1.0,
+            upsample_on_miss=False,
+            verify_tracking=True,
+            metrics=NULL_METRICS
+    ):
+        """
+        Arguments:
+            predictor (dlib.shape_predictor): 68 points landmarks predictor
+            detector: Face detector, defaults to dlib's frontal face detector
+            detect_every (int): Maximum number of frames between two full detections
+            margin (float): Margin added around the landmarks, relative to the face size
+            min_overlap (float): Minimum overlap between the landmarks of two consecutive
+                frames under which the face is considered lost
+            detection_scale (float): Scale of the grey image given to the detector, e.g. 0.5.
+                The landmarks are always predicted on the full resolution frame
+            upsample_on_miss (bool): Runs the detector again on an upsampled image
+                when no face was found
+            verify_tracking (bool): Checks with the detector that a tracked face
+                is still there, on every frame. A face that left or is covered is
+                otherwise only lost at the next full detection
+            metrics (metrics.Metrics): Records the detection and prediction times
+        """
+        self.predictor = predictor
+        self.detector = detector if detector is not None else dlib.get_frontal_face_detector()
+        self.detect_every = detect_every
+        self.margin = margin
+        self.min_overlap = min_overlap
+        self.detection_scale = detection_scale
+        self.upsample_on_miss = upsample_on_miss
+        self.verify_tracking = verify_tracking
+        self.metrics = metrics
+
+        self.nb_detections = 0
+        # Bounding boxes of the landmarks of the tracked faces
+        self._bounds = []
+        self._frames_since_detection = 0
+
+    def is_tracking(self):
+        """Returns true if a face is tracked from the previous frame"""
+        return len(self._bounds) > 0
+
+    def reset(self):
+        """Forgets the tracked faces, the next frame runs a full detection"""
+        self._bounds = []
+        self._frames_since_detection = 0
+
+    def follow(self, faces):
+        """Tracks faces found elsewhere from now on, e.g. by another locator
+        on a more recent frame.
+
+        Arguments:
+            faces (list): Landmarks (landmarks.Landmarks) of the faces
+        """
+        self._bounds = [landmarks.bounds() for landmarks in faces]
+
+    def _tracked_rect(self, frame, bounds):
+        """Returns the search rectangle derived from the previous landmarks"""
+        left, top, right, bottom = bounds
+        margin_x = int((right - left) * self.margin)
+        margin_y = int((bottom - top) * self.margin)
+        height, width = frame.shape[:2]
+        return dlib.rectangle(
+            int(max(left - margin_x, 0)),
+            int(max(top - margin_y, 0)),
+            int(min(right + margin_x, width - 1)),
+            int(min(bottom + margin_y, height - 1))
+        )
+
+    def _track(self, frame):
+        """Predicts the landmarks around the previous face positions.
+
+        Returns:
+            The landmarks of every face, or None if a face was lost
+        """
+        faces = []
+        for previous_bounds in self._bounds:
+            with self.metrics.timer('landmarks'):
+                landmarks = Landmarks.from_dlib(
+                    self.predictor(frame, self._tracked_rect(frame, previous_bounds))
+                )
+            if (bounds_overlap(landmarks.bounds(), previous_bounds) < self.min_overlap
+                    or (self.verify_tracking and not self._face_around(frame, landmarks.bounds()))):
+                self.metrics.count('tracking_losses')
+                return None
+            faces.append(landmarks)
+
+        self._bounds = [landmarks.bounds() for landmarks in faces]
+        return faces
+
+    def _face_around(self, frame, bounds):
+        """Returns true if the detector finds a face around the bounds of
+        tracked landmarks"""
+        left, top, right, bottom = [int(value) for value in bounds]
+        size = max(right - left, bottom - top, 1)
+        margin = int(size * self.VERIFY_MARGIN)
+        height, width = frame.shape[:2]
+        left, top = max(left - margin, 0), max(top - margin, 0)
+        right, bottom = min(right + margin, width), min(bottom + margin, height)
+        if right <= left or bottom <= top:
+            return False
+
+        region = frame[top:bottom, left:right]
+        if region.ndim == 3:
+            region = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+        scale = self.VERIFY_FACE_SIZE / size
+        region = cv2.resize(
+            region, None, fx=scale, fy=scale,
+            interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        )
+        with self.metrics.timer('tracking_check'):
+            return len(self.detector(region, 0)) > 0
+
+    def _detection_frame(self, frame):
+        """Returns the grey, downscaled frame given to the detector"""
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.detection_scale != 1.0:
+            frame = cv2.resize(
+                frame, None,
+                fx=self.detection_scale, fy=self.detection_scale,
+                interpolation=cv2.INTER_AREA
+            )
+        return frame
+
+    def _full_scale_rect(self, rect):
+        """Maps a rectangle found on the detection frame back to the full frame"""
+        scale = self.detection_scale
+        return dlib.rectangle(
+            int(rect.left() / scale),
+            int(rect.top() / scale),
+            int(rect.right() / scale),
+            int(rect.bottom() / scale)
+        )
+
+    def _detect(self, frame, max_faces):
+        """Runs the face detector on the whole frame.
+
+        Returns:
+            The landmarks of the faces found, at most max_faces of them
+        """
+        self.nb_detections += 1
+        self.metrics.count('detections')
+        with self.metrics.timer('detection'):
+            detection_frame = self._detection_frame(frame)
+            rects = self.detector(detection_frame, 0)
+            if len(rects) == 0 and self.upsample_on_miss:
+                rects = self.detector(detection_frame, 1)
+        if len(rects) == 0:
+            self.metrics.count('detection_misses')
+
+        rects = list(rects)[:max_faces]
+        with self.metrics.timer('landmarks'):
+            faces = [
+                Landmarks.from_dlib(self.predictor(frame, self._full_scale_rect(rect)))
+                for rect in rects
+            ]
+        self._bounds = [landmarks.bounds() for landmarks in faces]
+        return faces
+
+    def _locate(self, frame, max_faces):
+        faces = None
+        if self.is_tracking() and self._frames_since_detection < self.detect_every:
+            faces = self._track(frame)
+            self._frames_since_detection += 1
+
+        if faces is None:
+            self.reset()
+            faces = self._detect(frame, max_faces)
+
+        return faces
+
+    def locate(self, frame):
+        """Finds the facial landmarks of a single face in a new frame.
+
+        Argument:
+            frame (numpy.ndarray): Frame passed by the user
+
+        Returns:
+            The landmarks (landmarks.Landmarks), or None if no face was found
+        """
+        faces = self._locate(frame, 1)
+        return faces[0] if faces else None
+
+    def locate_all(self, frame):
+        """Finds the facial landmarks of every face in a new frame.
+
+        Argument:
+            frame (numpy.ndarray): Frame passed by the user
+
+        Returns:
+            A list of landmarks (landmarks.Landmarks), one per face
+        """
+        return self._locate(frame, None)
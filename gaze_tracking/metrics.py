@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import Counter, deque
+import numpy as np
+
+
+class _Timer(object):
+    """Context manager recording the time spent in its block"""
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.started)
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics(object):
+    """
+    This class records how long each stage of the analysis takes, over a
+    rolling window of the last calls, and counts events such as pupil or
+    detection misses. A snapshot can be exported periodically.
+    """
+
+    enabled = True
+
+    def __init__(self, window=1000, export_interval=None, exporter=None):
+        """
+        Arguments:
+            window (int): Number of latencies kept per stage
+            export_interval (float): Seconds between two exports, see maybe_export
+            exporter: Called with a snapshot at every export
+        """
+        self.window = window
+        self.export_interval = export_interval
+        self.exporter = exporter
+
+        self.counters = Counter()
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._last_export = time.time()
+
+    def timer(self, name):
+        """Returns a context manager timing its block as the given stage"""
+        return _Timer(self, name)
+
+    def record(self, name, seconds):
+        latencies = self._latencies.get(name)
+        if latencies is None:
+            latencies = self._latencies.setdefault(name, deque(maxlen=self.window))
+        latencies.append(seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def snapshot(self):
+        """Returns the counters and the latency percentiles (ms) of every stage"""
+        latencies = {}
+        for name, samples in list(self._latencies.items()):
+            samples = np.array(samples) * 1e3
+            if len(samples) == 0:
+                continue
+            p50, p90, p99 = np.percentile(samples, (50, 90, 99))
+            latencies[name] = {
+                'count': len(samples),
+                'mean_ms': float(samples.mean()),
+                'p50_ms': float(p50),
+                'p90_ms': float(p90),
+                'p99_ms': float(p99),
+            }
+        with self._lock:
+            counters = dict(self.counters)
+        return {'time': time.time(), 'counters': counters, 'latencies': latencies}
+
+    def maybe_export(self):
+        """Hands a snapshot to the exporter if export_interval elapsed since the last one"""
+        if self.exporter is None or self.export_interval is None:
+            return
+        now = time.time()
+        if now - self._last_export < self.export_interval:
+            return
+        self._last_export = now
+        self.exporter(self.snapshot())
+
+
+class NullMetrics(object):
+    """Same interface as Metrics, recording nothing"""
+
+    enabled = False
+
+    def timer(self, name):
+        return _NULL_TIMER
+
+    def record(self, name, seconds):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def snapshot(self):
+        return {'time': time.time(), 'counters': {}, 'latencies': {}}
+
+    def maybe_export(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
@@ -14,6 +14,10 @@ class Mouth(BaseFaceFeature):
     BOTTOM_LIP_INNER_POINTS = [60, 67, 66, 65, 64]
     BOTTOM_LIP_OUTER_POINTS = [48, 59, 58, 57, 56, 55, 54]
 
+    # Height / width ratios of the lip gap
+    HALF_OPEN_RATIO = 0.05
+    FULL_OPEN_RATIO = 0.2
+
     def __init__(self, landmarks, vect_calc, dimension_calc):
         super().__init__(vect_calc, dimension_calc)
         self.mouth_shape = None
@@ -29,19 +33,19 @@ class Mouth(BaseFaceFeature):
 
     def is_closed(self):
         if self.mouth_shape:
-            return self.mouth_shape[1] / self.mouth_shape[0] <= 0.05
+            return self.mouth_shape[1] / self.mouth_shape[0] <= self.HALF_OPEN_RATIO
         else:
             return True
 
     def is_half_open(self):
         if self.mouth_shape:
-            return 0.05 < self.mouth_shape[1] / self.mouth_shape[0] < 0.2
+            return self.HALF_OPEN_RATIO < self.mouth_shape[1] / self.mouth_shape[0] < self.FULL_OPEN_RATIO
         else:
             return False
 
     def is_full_open(self):
         if self.mouth_shape:
-            return self.mouth_shape[1] / self.mouth_shape[0] >= 0.2
+            return self.mouth_shape[1] / self.mouth_shape[0] >= self.FULL_OPEN_RATIO
         else:
             return False
 
@@ -50,8 +54,8 @@ class Mouth(BaseFaceFeature):
         """Returns the middle point (x,y) between two points
 
         Arguments:
-            p1 (dlib.point): First point
-            p2 (dlib.point): Second point
+            p1 (tuple): First point
+            p2 (tuple): Second point
         """
         x = int((p1[0] + p2[0]) / 2)
         y = int((p1[1] + p2[1]) / 2)
@@ -60,10 +64,8 @@ class Mouth(BaseFaceFeature):
     def _analyze(self, landmarks, upper_lip, lower_lip):
         ## take the center 3 points of the upper and lower lips
         # assume ordered left to write.
-        x_top_l = [landmarks.part(i).x for i in upper_lip]
-        y_top_l = [landmarks.part(i).y for i in upper_lip]
-        x_bottom_l = [landmarks.part(i).x for i in lower_lip]
-        y_bottom_l = [landmarks.part(i).y for i in lower_lip]
+        x_top_l, y_top_l = landmarks[upper_lip].T
+        x_bottom_l, y_bottom_l = landmarks[lower_lip].T
         av_top_lip = (np.mean(x_top_l), np.mean(y_top_l))
         av_bottom_lip = (np.mean(x_bottom_l), np.mean(y_bottom_l))
 
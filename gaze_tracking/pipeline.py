@@ -0,0 +1,327 @@
+import itertools
+import queue
+import threading
+import time
+from collections import namedtuple
+import cv2
+from .locator import FaceLocator
+from .scheduler import FrameScheduler
+
+
+PipelineResult = namedtuple('PipelineResult', ['index', 'timestamp', 'frame', 'result'])
+
+# Marks the end of the video source
+_END = object()
+
+
+class StageQueue(object):
+    """
+    Bounded queue between two stages of the pipeline. When it is full, a
+    new item either drops the oldest one (so the stage behind only ever sees
+    recent frames) or waits for a free slot.
+    """
+
+    def __init__(self, maxsize, drop_oldest=True, stop_event=None):
+        self.maxsize = maxsize
+        self.drop_oldest = drop_oldest
+        # a blocked put gives up once this event is set
+        self.stop_event = stop_event
+        self.nb_dropped = 0
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+
+    def put(self, item):
+        """Adds an item, the end of stream marker is never dropped"""
+        if not self.drop_oldest:
+            while self.stop_event is None or not self.stop_event.is_set():
+                try:
+                    self._queue.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+            return
+
+        with self._lock:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        dropped = self._queue.get_nowait()
+                    except queue.Empty:
+                        continue
+                    if dropped is _END:
+                        # keep the end of stream, lose the new item instead
+                        self._queue.put_nowait(dropped)
+                        return
+                    self.nb_dropped += 1
+
+    def get(self, timeout=None):
+        return self._queue.get(timeout=timeout)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+class Pipeline(object):
+    """
+    This class runs the capture, the analysis and the output of the frames
+    on separate threads. A capture thread reads the video source, a pool
+    of workers analyses the frames (OpenCV and dlib release the GIL) and
+    the results are handed back in capture order. Whatever has to see the
+    frames one at a time and in order, e.g. a FaceSession, goes into the
+    ordered stage.
+    """
+
+    def __init__(
+            self,
+            source,
+            process_factory,
+            workers=2,
+            capture_depth=2,
+            output_depth=2,
+            drop_oldest=True,
+            ordered=None
+    ):
+        """
+        Arguments:
+            source: cv2.VideoCapture, or a camera index / video path to open
+            process_factory: Called once per worker, returns the function
+                analysing a frame for that worker, called with the frame and
+                its capture time (time.time())
+            workers (int): Number of analysis threads
+            capture_depth (int): Frames waiting for a worker
+            output_depth (int): Results waiting to be consumed
+            drop_oldest (bool): Drops the oldest frames of a full queue instead
+                of blocking the stage feeding it
+            ordered: Called with every PipelineResult, one at a time and in
+                capture order, returns the PipelineResult passed on
+        """
+        self._own_capture = not isinstance(source, cv2.VideoCapture)
+        self.capture = cv2.VideoCapture(source) if self._own_capture else source
+        self.process_factory = process_factory
+        self.nb_workers = workers
+        self.ordered = ordered
+
+        self._stop = threading.Event()
+        self.capture_queue = StageQueue(capture_depth, drop_oldest, self._stop)
+        self.output_queue = StageQueue(output_depth, drop_oldest, self._stop)
+
+        self.nb_frames = 0
+        self.nb_errors = 0
+        self.last_error = None
+
+        self._threads = []
+        # Workers take the frames and their sequence numbers under this lock,
+        # so that the sequence follows the capture order.
+        self._take_lock = threading.Lock()
+        self._sequence = itertools.count()
+        # Results finished ahead of their turn
+        self._reorder_lock = threading.Lock()
+        self._pending = {}
+        self._next_sequence = 0
+        self._nb_workers_done = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._stop.clear()
+        self._nb_workers_done = 0
+        self._threads = [threading.Thread(target=self._capture, daemon=True)]
+        self._threads += [
+            threading.Thread(target=self._work, daemon=True) for _ in range(self.nb_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._own_capture:
+            self.capture.release()
+
+    def stats(self):
+        """Returns the depth and the number of dropped frames of each queue"""
+        return {
+            'frames': self.nb_frames,
+            'errors': self.nb_errors,
+            'capture_queue': self.capture_queue.qsize(),
+            'capture_dropped': self.capture_queue.nb_dropped,
+            'output_queue': self.output_queue.qsize(),
+            'output_dropped': self.output_queue.nb_dropped,
+        }
+
+    def _capture(self):
+        index = 0
+        while not self._stop.is_set():
+            success, frame = self.capture.read()
+            if not success:
+                break
+            self.capture_queue.put((index, time.time(), frame))
+            index += 1
+        self.capture_queue.put(_END)
+
+    def _take(self):
+        """Returns the next captured frame and its sequence number, or None when stopped"""
+        while not self._stop.is_set():
+            with self._take_lock:
+                try:
+                    item = self.capture_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    # leave it for the other workers
+                    self.capture_queue.put(_END)
+                    return None
+                return next(self._sequence), item
+        return None
+
+    def _work(self):
+        process = self.process_factory()
+        while True:
+            taken = self._take()
+            if taken is None:
+                break
+
+            sequence, (index, timestamp, frame) = taken
+            try:
+                result = process(frame, timestamp)
+            except Exception as error:
+                result = None
+                self.nb_errors += 1
+                self.last_error = error
+            self._emit(sequence, PipelineResult(index, timestamp, frame, result))
+
+        self._finish()
+
+    def _emit(self, sequence, result):
+        """Passes the results on in sequence order"""
+        with self._reorder_lock:
+            self._pending[sequence] = result
+            while self._next_sequence in self._pending:
+                result = self._pending.pop(self._next_sequence)
+                if self.ordered is not None:
+                    result = self._run_ordered(result)
+                self.output_queue.put(result)
+                self._next_sequence += 1
+                self.nb_frames += 1
+
+    def _run_ordered(self, result):
+        try:
+            return self.ordered(result)
+        except Exception as error:
+            self.nb_errors += 1
+            self.last_error = error
+            return result._replace(result=None)
+
+    def _finish(self):
+        """Ends the output once the last worker is done"""
+        with self._reorder_lock:
+            self._nb_workers_done += 1
+            if self._nb_workers_done == self.nb_workers:
+                self.output_queue.put(_END)
+
+    def results(self):
+        """Yields the analysed frames (PipelineResult) in capture order"""
+        while True:
+            try:
+                item = self.output_queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            if item is _END:
+                return
+            yield item
+
+
+class FaceAnalysis(object):
+    """
+    This class analyses the frames of a single face in a Pipeline. The
+    FaceSession keeps the state of the face from one frame to the next and
+    isn't thread safe, so the workers only find the landmarks and the
+    session analyzes them one frame at a time, in capture order:
+
+        analysis = FaceAnalysis(predictor, session)
+        pipeline = Pipeline(0, analysis.process_factory, ordered=analysis.analyze)
+
+    Each worker has its own FaceLocator, which tracks the face from the most
+    recent landmarks found by any of the workers.
+    """
+
+    def __init__(self, predictor, session, scheduler=None, **locator_options):
+        """
+        Arguments:
+            predictor (dlib.shape_predictor): 68 points landmarks predictor
+            session (session.FaceSession): Session of the face
+            scheduler (scheduler.FrameScheduler): Decides for every frame, a skipped
+                frame has no result. Every frame is analyzed in full by default
+            locator_options: Passed on to FaceLocator
+        """
+        self.predictor = predictor
+        self.session = session
+        self.scheduler = scheduler
+        self.locator_options = locator_options
+
+        # The scheduler and the most recent landmarks are shared by the workers
+        self._lock = threading.Lock()
+        self._latest_timestamp = None
+        self._latest_landmarks = None
+
+    def process_factory(self):
+        """Returns the function of a worker, finding the landmarks of a frame"""
+        locator = FaceLocator(self.predictor, **self.locator_options)
+        followed = [None]
+
+        def process(frame, timestamp=None):
+            with self._lock:
+                decision = self.scheduler.decide(timestamp) if self.scheduler is not None else None
+                latest_timestamp, latest_landmarks = self._latest_timestamp, self._latest_landmarks
+            if decision == FrameScheduler.SKIP:
+                return decision, None, 0.0
+
+            # the other workers may have seen the face on a more recent frame
+            if latest_landmarks is not None and latest_timestamp != followed[0]:
+                locator.follow([latest_landmarks])
+                followed[0] = latest_timestamp
+
+            started = time.perf_counter()
+            landmarks = locator.locate(frame)
+            seconds = time.perf_counter() - started
+
+            with self._lock:
+                if self._latest_timestamp is None or (timestamp or 0.0) >= self._latest_timestamp:
+                    self._latest_timestamp = timestamp or 0.0
+                    self._latest_landmarks = landmarks
+                    followed[0] = self._latest_timestamp
+            return decision, landmarks, seconds
+
+        return process
+
+    def analyze(self, result):
+        """Analyzes the landmarks of a PipelineResult, to pass as the ordered
+        stage of the Pipeline. Returns the result with the face.Face, None when
+        the frame was skipped"""
+        if result.result is None:
+            return result
+        decision, landmarks, seconds = result.result
+        if decision == FrameScheduler.SKIP:
+            return result._replace(result=None)
+
+        started = time.perf_counter()
+        face = self.session.analyze(
+            result.frame, landmarks, timestamp=result.timestamp,
+            degraded=decision == FrameScheduler.DEGRADED
+        )
+        if decision is not None:
+            with self._lock:
+                self.scheduler.record(decision, seconds + time.perf_counter() - started)
+        return result._replace(result=face)
@@ -8,13 +8,43 @@ class Pupil(object):
     the position of the pupil
     """
 
-    def __init__(self, eye_frame, threshold):
+    # Half size of the tracking window, relative to the width of the eye frame
+    TRACKING_WINDOW = 0.25
+    # Smallest iris accepted by the tracking, in pixels
+    TRACKING_MIN_AREA = 4
+
+    def __init__(self, eye_frame, threshold, previous=None):
+        """
+        Arguments:
+            eye_frame (numpy.ndarray): Frame containing an eye and nothing else
+            threshold (int): Threshold value used to binarize the eye frame
+            previous (tuple): Position (x, y) of the pupil in the previous frame,
+                in the coordinates of this eye frame. The search starts around it
+        """
         self.iris_frame = None
         self.threshold = threshold
         self.x = None
         self.y = None
+        self.tracked = False
 
-        self.detect_iris(eye_frame)
+        if previous is not None:
+            self.track_iris(eye_frame, previous)
+        if not self.tracked:
+            self.detect_iris(eye_frame)
+
+    @staticmethod
+    def filter_frame(eye_frame):
+        """Smooths and erodes the eye frame, everything image_processing
+        does before the binarization
+
+        Argument:
+            eye_frame (numpy.ndarray): Frame containing an eye and nothing else
+        """
+        kernel = np.ones((3, 3), np.uint8)
+        new_frame = cv2.bilateralFilter(eye_frame, 10, 15, 15)
+        new_frame = cv2.erode(new_frame, kernel, iterations=3)
+
+        return new_frame
 
     @staticmethod
     def image_processing(eye_frame, threshold):
@@ -27,13 +57,56 @@ class Pupil(object):
         Returns:
             A frame with a single element representing the iris
         """
-        kernel = np.ones((3, 3), np.uint8)
-        new_frame = cv2.bilateralFilter(eye_frame, 10, 15, 15)
-        new_frame = cv2.erode(new_frame, kernel, iterations=3)
+        new_frame = Pupil.filter_frame(eye_frame)
         new_frame = cv2.threshold(new_frame, threshold, 255, cv2.THRESH_BINARY)[1]
 
         return new_frame
 
+    def track_iris(self, eye_frame, previous):
+        """Looks for the iris in a small window around its previous position,
+        and takes the centroid of the largest dark blob found there, unless
+        the window cuts it.
+
+        Arguments:
+            eye_frame (numpy.ndarray): Frame containing an eye and nothing else
+            previous (tuple): Position (x, y) of the pupil in the previous frame
+        """
+        height, width = eye_frame.shape[:2]
+        x, y = int(previous[0]), int(previous[1])
+        if not (0 <= x < width and 0 <= y < height):
+            return
+
+        window = max(int(width * self.TRACKING_WINDOW), 3)
+        left, top = max(x - window, 0), max(y - window, 0)
+        right, bottom = min(x + window + 1, width), min(y + window + 1, height)
+
+        self.iris_frame = self.image_processing(eye_frame[top:bottom, left:right], self.threshold)
+        # the iris is black on the binarized frame
+        nb_labels, _, stats, centroids = cv2.connectedComponentsWithStats(
+            cv2.bitwise_not(self.iris_frame), connectivity=8
+        )
+        if nb_labels < 2:
+            return
+
+        label = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+        if stats[label, cv2.CC_STAT_AREA] < self.TRACKING_MIN_AREA:
+            return
+
+        # A blob cut by the window (where the window isn't on the edge of the
+        # eye frame) is only part of the iris, e.g. after a saccade, and its
+        # centroid is off. The full search finds it whole.
+        blob_left, blob_top = stats[label, cv2.CC_STAT_LEFT], stats[label, cv2.CC_STAT_TOP]
+        blob_right = blob_left + stats[label, cv2.CC_STAT_WIDTH]
+        blob_bottom = blob_top + stats[label, cv2.CC_STAT_HEIGHT]
+        if ((blob_left == 0 and left > 0) or (blob_top == 0 and top > 0)
+                or (blob_right == right - left and right < width)
+                or (blob_bottom == bottom - top and bottom < height)):
+            return
+
+        self.x = int(left + centroids[label][0])
+        self.y = int(top + centroids[label][1])
+        self.tracked = True
+
     def detect_iris(self, eye_frame):
         """Detects the iris and estimates the position of the iris by
         calculating the centroid.
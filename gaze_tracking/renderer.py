@@ -0,0 +1,159 @@
+import numpy as np
+import cv2
+
+
+class AnnotationRenderer(object):
+    """
+    This class draws the annotations of the analyzed faces, the same ones
+    as Face.annotate and Face.draw_vecs. Primitives sharing a style are
+    drawn in a single call. They can go to an overlay layer, drawn once and
+    composited onto as many frames as needed, or nowhere in headless mode.
+    """
+
+    GREEN = (0, 255, 0)
+    BLUE = (255, 0, 0)
+    RED = (0, 0, 255)
+
+    def __init__(self, overlay=False, headless=False):
+        """
+        Arguments:
+            overlay (bool): Draws into a reusable overlay layer instead of the frame
+            headless (bool): Draws nothing at all
+        """
+        self.use_overlay = overlay
+        self.headless = headless
+        self.overlay = None
+        self.mask = None
+        self.region = None
+        # anti aliased edges would blend with the black of the overlay and
+        # leave a dark halo once composited
+        self.line_type = cv2.LINE_8 if overlay else cv2.LINE_AA
+
+    @staticmethod
+    def _primitives(faces):
+        """Groups the primitives of all the faces by style.
+
+        Returns:
+            Lists of points arrays for the boxes, the box edges and vectors,
+            the landmark dots, and the pupil, brow and mouth lines
+        """
+        boxes, lines, dots, pupils, brows, mouths = [], [], [], [], [], []
+        for face in faces:
+            if not face.is_detected():
+                continue
+
+            box = face.annotation_box()
+            boxes.append(box)
+            lines += [box[[1, 6]], box[[2, 7]], box[[3, 8]]]
+            if face.face_shape is not None:
+                dots.append(face.face_shape)
+
+            if face.eyes is not None:
+                for eye in face.eyes:
+                    if eye.pupils_located:
+                        x, y = eye.pupil_coords()
+                        pupils += [np.int32([(x - 5, y), (x + 5, y)]), np.int32([(x, y - 5), (x, y + 5)])]
+            if face.brows is not None:
+                for brow in face.brows:
+                    if brow.position is not None:
+                        x, y = brow.position
+                        brows.append(np.int32([(x - 10, y), (x + 10, y)]))
+            if face.mouth is not None and face.mouth.is_located():
+                x, y = face.mouth.mouth_center_location
+                width, height = face.mouth.mouth_shape
+                left, top = int(x - width / 2), int(y - height / 2)
+                right, bottom = int(x + width / 2), int(y + height / 2)
+                mouths.append(np.int32([(left, top), (right, top), (right, bottom), (left, bottom)]))
+
+            if face.all_located():
+                lines += [
+                    np.vstack((feature.vector_flat_projection['start'], feature.vector_flat_projection['end']))
+                    for feature in face.features()
+                ]
+
+        if dots:
+            # zero length segments, see Face.annotated_face_shape
+            dots = list(np.repeat(np.vstack(dots)[:, None, :], 2, axis=1))
+        return boxes, lines, dots, pupils, brows, mouths
+
+    def draw(self, image, faces):
+        """Draws the annotations of the faces on the given image"""
+        self._draw(image, self._primitives(faces))
+        return image
+
+    def _draw(self, image, primitives):
+        boxes, lines, dots, pupils, brows, mouths = primitives
+        if boxes:
+            cv2.polylines(image, boxes, True, self.GREEN, 2, self.line_type)
+        if lines:
+            cv2.polylines(image, lines, False, self.GREEN, 2, self.line_type)
+        if dots:
+            cv2.polylines(image, dots, False, self.GREEN, 4)
+        if pupils:
+            cv2.polylines(image, pupils, False, self.GREEN)
+        if brows:
+            cv2.polylines(image, brows, False, self.BLUE)
+        if mouths:
+            cv2.polylines(image, mouths, True, self.RED)
+
+    @staticmethod
+    def _region(primitives, shape):
+        """Returns the slices of the frame the primitives are drawn in, or None"""
+        points = [points for group in primitives for points in group]
+        if not points:
+            return None
+        points = np.vstack(points).reshape(-1, 2)
+        # margin for the line thickness
+        left, top = np.maximum(points.min(axis=0) - 3, 0)
+        right, bottom = points.max(axis=0) + 4
+        if left >= shape[1] or top >= shape[0] or right <= 0 or bottom <= 0:
+            return None
+        return slice(top, bottom), slice(left, right)
+
+    def draw_overlay(self, faces, shape):
+        """Draws the annotations of the faces on the overlay layer, replacing
+        the previous ones. Only the region around the annotations is cleared,
+        masked and composited.
+
+        Arguments:
+            faces (list): Analyzed faces
+            shape (tuple): Shape of the frames the overlay will be composited on
+        """
+        if self.overlay is None or self.overlay.shape != shape:
+            self.overlay = np.zeros(shape, np.uint8)
+            self.mask = np.zeros(shape[:2], np.uint8)
+        elif self.region is not None:
+            self.overlay[self.region] = 0
+
+        primitives = self._primitives(faces)
+        self.region = self._region(primitives, shape)
+        if self.region is None:
+            return self.overlay
+
+        self._draw(self.overlay, primitives)
+        # every colour used has a non zero grey level
+        self.mask[self.region] = cv2.cvtColor(self.overlay[self.region], cv2.COLOR_BGR2GRAY)
+        return self.overlay
+
+    def composite(self, frame):
+        """Copies the overlay layer onto the frame"""
+        if self.headless or self.region is None:
+            return frame
+        region = frame[self.region]
+        cv2.copyTo(self.overlay[self.region], self.mask[self.region], region)
+        return frame
+
+    def render(self, frame, faces):
+        """Annotates the frame with the faces, through the overlay if enabled.
+
+        Arguments:
+            frame (numpy.ndarray): Frame to annotate
+            faces (list): Analyzed faces
+        """
+        if self.headless:
+            return frame
+        if not self.use_overlay:
+            return self.draw(frame, faces)
+
+        self.draw_overlay(faces, frame.shape)
+        return self.composite(frame)
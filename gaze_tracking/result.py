@@ -0,0 +1,237 @@
+"""
+Compact results of the analysis, holding no frame.
+
+A Face keeps its frame, the eye patches and the pupil frames alive. A
+FaceResult only keeps the numbers, and RESULT is the same as a NumPy
+record (under 1KB), so results stack into arrays. A 10 minutes
+ResultHistory at 30 fps is about 17MB, 28KB per second.
+
+Missing values are NaN, states are -1 when unknown.
+"""
+import time
+import numpy as np
+
+# Order of the features in RESULT['vectors'], see Face.features
+VECTOR_FEATURES = ('left_brow', 'right_brow', 'left_eye', 'right_eye', 'mouth')
+
+RESULT = np.dtype([
+    ('frame_index', '<i8'),
+    ('timestamp', '<f8'),
+    ('located', 'u1'),
+    # 0 open, 1 blinking
+    ('blinking_state', 'i1', (2,)),
+    # 0 furrowed, 1 neutral, 2 raised
+    ('brow_state', 'i1', (2,)),
+    # 0 closed, 1 half open, 2 full open
+    ('mouth_state', 'i1'),
+    ('landmarks', '<f4', (68, 2)),
+    ('rotation_vector', '<f8', (3,)),
+    ('translation_vector', '<f8', (3,)),
+    ('pupils', '<f4', (2, 2)),
+    # width / height ratio of the eyes, see Eye.blinking
+    ('blinking', '<f4', (2,)),
+    ('brow_distance', '<f4', (2,)),
+    ('mouth_shape', '<f4', (2,)),
+    # start x, y, z, end x, y, z and distance of every feature vector
+    ('vectors', '<f8', (5, 7)),
+])
+
+_FLOAT_FIELDS = (
+    'landmarks', 'rotation_vector', 'translation_vector', 'pupils',
+    'blinking', 'brow_distance', 'mouth_shape', 'vectors'
+)
+_STATE_FIELDS = ('blinking_state', 'brow_state', 'mouth_state')
+
+
+def empty_results(nb_frames):
+    """Returns nb_frames RESULT records of missing values"""
+    results = np.zeros(nb_frames, RESULT)
+    for name in _FLOAT_FIELDS:
+        results[name] = np.nan
+    for name in _STATE_FIELDS:
+        results[name] = -1
+    return results
+
+
+def _state(checks):
+    """Returns the index of the first true check, -1 if none"""
+    for state, check in enumerate(checks):
+        if check():
+            return state
+    return -1
+
+
+class FaceResult(object):
+    """
+    This class holds the analysis of a face in a frame: the landmarks, the
+    pose, the feature states and vectors, and nothing of the frame.
+    """
+
+    __slots__ = ('frame_index', 'timestamp', 'located') + _STATE_FIELDS + _FLOAT_FIELDS
+
+    def __init__(self, frame_index=0, timestamp=None):
+        """
+        Arguments:
+            frame_index (int): Index of the frame
+            timestamp (float): Time of the frame, now by default
+        """
+        self.frame_index = frame_index
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.located = False
+        self.blinking_state = [-1, -1]
+        self.brow_state = [-1, -1]
+        self.mouth_state = -1
+        self.landmarks = None
+        self.rotation_vector = None
+        self.translation_vector = None
+        self.pupils = [None, None]
+        self.blinking = [None, None]
+        self.brow_distance = [None, None]
+        self.mouth_shape = None
+        # one (start, end, distance) tuple per feature of VECTOR_FEATURES, or None
+        self.vectors = [None] * len(VECTOR_FEATURES)
+
+    @classmethod
+    def from_face(cls, face, frame_index=0, timestamp=None):
+        """Returns the result of an analyzed Face, which may be None"""
+        result = cls(frame_index, timestamp)
+        if face is None or not face.is_detected():
+            return result
+
+        result.located = True
+        result.landmarks = face.landmarks.points.astype(np.float32)
+        result.rotation_vector = face.rotational_vector.ravel().copy()
+        result.translation_vector = face.translation_vector.ravel().copy()
+        if face.eyes is not None:
+            for side, eye in enumerate(face.eyes):
+                if eye.pupils_located:
+                    result.pupils[side] = eye.pupil_coords()
+                    blinking = eye.is_blinking()
+                    if blinking is not None:
+                        result.blinking_state[side] = int(blinking)
+                result.blinking[side] = eye.blinking
+        if face.brows is not None:
+            for side, brow in enumerate(face.brows):
+                if brow.distance_from_nose is not None:
+                    result.brow_distance[side] = brow.distance_from_nose
+                    result.brow_state[side] = _state((brow.is_furrowed, brow.is_neutral, brow.is_raised))
+        mouth = face.mouth
+        if mouth is not None and mouth.mouth_shape is not None:
+            result.mouth_shape = mouth.mouth_shape
+            result.mouth_state = _state((mouth.is_closed, mouth.is_half_open, mouth.is_full_open))
+
+        features = list(face.brows or (None, None)) + list(face.eyes or (None, None)) + [face.mouth]
+        for index, feature in enumerate(features):
+            if feature is not None and feature.vector is not None:
+                vector = feature.vector
+                result.vectors[index] = (
+                    np.ravel(vector['start']).copy(), np.ravel(vector['end']).copy(), float(np.ravel(vector['dist'])[0])
+                )
+        return result
+
+    def to_record(self, record):
+        """Writes the result into a RESULT record, or any record with its fields"""
+        record['frame_index'] = self.frame_index
+        record['timestamp'] = self.timestamp
+        record['located'] = self.located
+        record['blinking_state'] = self.blinking_state
+        record['brow_state'] = self.brow_state
+        record['mouth_state'] = self.mouth_state
+        for name in ('landmarks', 'rotation_vector', 'translation_vector', 'mouth_shape'):
+            value = getattr(self, name)
+            record[name] = value if value is not None else np.nan
+        for name in ('pupils', 'blinking', 'brow_distance'):
+            for side, value in enumerate(getattr(self, name)):
+                record[name][side] = value if value is not None else np.nan
+        for index, vector in enumerate(self.vectors):
+            if vector is None:
+                record['vectors'][index] = np.nan
+            else:
+                start, end, dist = vector
+                record['vectors'][index, :3] = start
+                record['vectors'][index, 3:6] = end
+                record['vectors'][index, 6] = dist
+        return record
+
+    def to_array(self):
+        """Returns the result as a single RESULT record"""
+        return self.to_record(np.zeros((), RESULT))
+
+    @classmethod
+    def from_record(cls, record):
+        """Returns the result of a RESULT record"""
+        result = cls(int(record['frame_index']), float(record['timestamp']))
+        result.located = bool(record['located'])
+        result.blinking_state = record['blinking_state'].tolist()
+        result.brow_state = record['brow_state'].tolist()
+        result.mouth_state = int(record['mouth_state'])
+        if not result.located:
+            return result
+
+        result.landmarks = record['landmarks'].copy()
+        result.rotation_vector = record['rotation_vector'].copy()
+        result.translation_vector = record['translation_vector'].copy()
+        if not np.isnan(record['mouth_shape'][0]):
+            result.mouth_shape = tuple(record['mouth_shape'].tolist())
+        for name in ('pupils', 'blinking', 'brow_distance'):
+            setattr(result, name, [
+                None if np.any(np.isnan(value)) else (tuple(value.tolist()) if np.ndim(value) else float(value))
+                for value in record[name]
+            ])
+        result.vectors = [
+            None if np.isnan(vector[6]) else (vector[:3].copy(), vector[3:6].copy(), float(vector[6]))
+            for vector in record['vectors']
+        ]
+        return result
+
+    def as_dict(self):
+        """Returns the result as a dict of lists and numbers, e.g. for JSON"""
+        def plain(value):
+            if isinstance(value, np.ndarray):
+                return value.tolist()
+            if isinstance(value, np.generic):
+                return value.item()
+            if isinstance(value, (tuple, list)):
+                return [plain(item) for item in value]
+            return value
+
+        return {name: plain(getattr(self, name)) for name in self.__slots__}
+
+
+class ResultHistory(object):
+    """
+    This class keeps the last results in a preallocated RESULT array, the
+    oldest ones are overwritten.
+    """
+
+    def __init__(self, seconds=600, fps=30.0):
+        """
+        Arguments:
+            seconds (float): Length of the history
+            fps (float): Frame rate of the results
+        """
+        self.records = empty_results(max(int(seconds * fps), 1))
+        self.nb_results = 0
+
+    def __len__(self):
+        return min(self.nb_results, len(self.records))
+
+    def append(self, result):
+        """Adds a FaceResult, or a Face"""
+        if not isinstance(result, FaceResult):
+            result = FaceResult.from_face(result, self.nb_results)
+        result.to_record(self.records[self.nb_results % len(self.records)])
+        self.nb_results += 1
+
+    def array(self):
+        """Returns a copy of the results, oldest first"""
+        if self.nb_results <= len(self.records):
+            return self.records[:self.nb_results].copy()
+        start = self.nb_results % len(self.records)
+        return np.concatenate((self.records[start:], self.records[:start]))
+
+    def last(self):
+        """Returns the last FaceResult, or None"""
+        if not self.nb_results:
+            return None
+        return FaceResult.from_record(self.records[(self.nb_results - 1) % len(self.records)])
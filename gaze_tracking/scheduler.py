@@ -0,0 +1,112 @@
+import time
+from .metrics import NULL_METRICS
+
+
+class FrameScheduler(object):
+    """
+    This class decides, frame by frame, how much of the analysis fits in
+    the latency budget. It keeps a running estimate of the time taken by
+    the full and the degraded analysis, and of how late the frames are:
+    a frame gets the full analysis if it will still be on time, the
+    degraded one (landmarks only, last pose and pupils reused) if that
+    fits instead, and is skipped otherwise.
+    """
+
+    FULL = 'full'
+    DEGRADED = 'degraded'
+    SKIP = 'skip'
+
+    def __init__(self, target_fps=30.0, latency_budget=None, smoothing=0.2, probe_interval=30,
+                 max_skips=5, metrics=NULL_METRICS):
+        """
+        Arguments:
+            target_fps (float): Rate at which the frames come in
+            latency_budget (float): Longest a frame may wait and be analyzed, in
+                seconds, one frame period by default
+            smoothing (float): Weight of the last frame in the time estimates
+            probe_interval (int): Largest number of degraded frames in a row,
+                the next one gets the full analysis to keep its estimate fresh.
+                Skipped frames count as well
+            max_skips (int): Largest number of skipped frames in a row, the next
+                one is analyzed anyway so the estimates can come back down
+            metrics (metrics.Metrics): Counts the decisions and times them
+        """
+        self.frame_period = 1.0 / target_fps
+        self.latency_budget = latency_budget if latency_budget is not None else self.frame_period
+        self.smoothing = smoothing
+        self.probe_interval = probe_interval
+        self.max_skips = max_skips
+        self.metrics = metrics
+
+        # Running estimates of the analysis times, None until tried once
+        self.costs = {self.FULL: None, self.DEGRADED: None}
+        # How far behind the incoming frames the analysis is, when the
+        # frames come without a timestamp
+        self.lag = 0.0
+        self._since_full = 0
+        self._skipped = 0
+
+    def decide(self, timestamp=None):
+        """Returns FULL, DEGRADED or SKIP for a new frame.
+
+        Arguments:
+            timestamp (float): Capture time of the frame (time.time()), its age
+                counts against the budget. Without it, the lag accumulated by
+                the previous frames does
+        """
+        lag = time.time() - timestamp if timestamp is not None else self.lag
+        full_cost = self.costs[self.FULL]
+        degraded_cost = self.costs[self.DEGRADED]
+
+        if full_cost is None or lag + full_cost <= self.latency_budget:
+            decision = self.FULL
+        elif (degraded_cost is None or lag + degraded_cost <= self.latency_budget
+              or self._skipped >= self.max_skips):
+            # the estimates only change on analyzed frames, without a probe
+            # once in a while a slow spell would skip every frame from then on
+            decision = self.FULL if self._since_full >= self.probe_interval else self.DEGRADED
+        else:
+            decision = self.SKIP
+
+        self.metrics.record('scheduler_lag', lag)
+        self.metrics.count('scheduler_' + decision)
+        if decision == self.SKIP:
+            # a skipped frame lets the analysis catch up by a frame
+            self.lag = max(0.0, self.lag - self.frame_period)
+            self._since_full += 1
+            self._skipped += 1
+        return decision
+
+    def record(self, decision, seconds):
+        """Takes the time spent on a frame into the estimates.
+
+        Arguments:
+            decision (str): FULL or DEGRADED, as returned by decide
+            seconds (float): Time spent analyzing the frame
+        """
+        cost = self.costs[decision]
+        self.costs[decision] = seconds if cost is None else cost + self.smoothing * (seconds - cost)
+        self.lag = max(0.0, self.lag + seconds - self.frame_period)
+        self._since_full = 0 if decision == self.FULL else self._since_full + 1
+        self._skipped = 0
+        self.metrics.record('scheduler_' + decision, seconds)
+
+    def schedule(self, full, degraded, timestamp=None):
+        """Decides for a new frame and runs the chosen analysis.
+
+        Arguments:
+            full: Called without arguments for the full analysis
+            degraded: Called without arguments for the degraded analysis
+            timestamp (float): Capture time of the frame, see decide
+
+        Returns:
+            The decision and the result of the analysis, None when skipped
+        """
+        decision = self.decide(timestamp)
+        if decision == self.SKIP:
+            return decision, None
+
+        started = time.perf_counter()
+        result = full() if decision == self.FULL else degraded()
+        self.record(decision, time.perf_counter() - started)
+        return decision, result
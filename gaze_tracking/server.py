@@ -0,0 +1,392 @@
+"""
+Local analysis server, so that several processes share one loaded shape
+predictor.
+
+    python -m gaze_tracking.server serve --model shape_predictor_68_face_landmarks.dat
+    python -m gaze_tracking.server load --video video.mp4 --clients 8
+
+The server listens on a Unix socket. Every message is a 4 bytes big endian
+length followed by that many bytes of JSON, a request header is followed by
+its frame: header['size'] bytes, either raw pixels of header['shape'] or an
+image file (JPEG, PNG...) when header['encoding'] is 'image'. Every reply
+is a single JSON message.
+
+Requests arriving together are batched: a batch is collected for at most
+max_delay seconds or max_batch requests, its frames are decoded, and the
+requests of each session go to the worker pool in order. Each session (one
+per connection unless the header names one) has its own FaceSession and
+FaceLocator.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from .metrics import Metrics
+from .result import FaceResult
+
+DEFAULT_SOCKET = '/tmp/facepuppet.sock'
+
+_LENGTH = struct.Struct('>I')
+
+
+def _encode(message):
+    data = json.dumps(message).encode()
+    return _LENGTH.pack(len(data)) + data
+
+
+def decode_frame(header, payload):
+    """Returns the BGR frame of a request"""
+    if header.get('encoding', 'raw') == 'image':
+        frame = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("The image can't be decoded")
+        return frame
+    return np.frombuffer(payload, np.uint8).reshape(header['shape'])
+
+
+class _Session(object):
+    """Analysis state of a client session, used by one worker at a time"""
+
+    def __init__(self, locator):
+        self.locator = locator
+        self.session = None
+        self.lock = threading.Lock()
+
+    def analyze(self, frame, features):
+        # imported here, the session module is not needed by the clients
+        from .session import FaceSession
+        dimensions = (frame.shape[1], frame.shape[0])
+        if self.session is None or self.session.dimensions != dimensions:
+            self.session = FaceSession(dimensions)
+            self.locator.reset()
+        return self.session.analyze(frame, self.locator.locate(frame), features=features)
+
+
+class AnalysisServer(object):
+    """
+    This class serves the analysis of frames to local clients, batching the
+    requests across a pool of worker threads.
+    """
+
+    def __init__(self, predictor, path=DEFAULT_SOCKET, workers=4, max_batch=8, max_delay=0.002,
+                 metrics=None, **locator_options):
+        """
+        Arguments:
+            predictor (dlib.shape_predictor): 68 points landmarks predictor
+            path (str): Path of the Unix socket
+            workers (int): Number of threads analyzing the frames
+            max_batch (int): Largest number of requests of a batch
+            max_delay (float): Longest wait, in seconds, for a batch to fill up
+            metrics (metrics.Metrics): Records the queue, batch and request times
+            locator_options: Passed on to the FaceLocator of every session
+        """
+        self.predictor = predictor
+        self.path = path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.locator_options = locator_options
+
+        self.sessions = {}
+        # Connections using each session, it goes when the last one closes
+        self._users = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._queue = None
+        self._server = None
+        self._connections = 0
+
+    def _session(self, name):
+        session = self.sessions.get(name)
+        if session is None:
+            # imported here, dlib is not needed by the clients
+            from .locator import FaceLocator
+            session = self.sessions[name] = _Session(
+                FaceLocator(self.predictor, **self.locator_options)
+            )
+        return session
+
+    def stats(self):
+        """Returns the queue depth, the mean batch size, the sessions and the metrics snapshot"""
+        snapshot = self.metrics.snapshot()
+        counters = snapshot['counters']
+        snapshot['queue'] = self._queue.qsize() if self._queue is not None else 0
+        snapshot['batch_size'] = (
+            counters['server_batched_requests'] / counters['server_batches']
+            if counters.get('server_batches') else 0.0
+        )
+        snapshot['sessions'] = len(self.sessions)
+        snapshot['connections'] = self._connections
+        return snapshot
+
+    async def serve(self):
+        """Serves until cancelled"""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._queue = asyncio.Queue()
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        batcher = asyncio.ensure_future(self._batch_loop())
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            batcher.cancel()
+            self._executor.shutdown(wait=False)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def _handle(self, reader, writer):
+        """Reads the requests of a connection and writes their replies in order"""
+        self._connections += 1
+        connection = id(writer)
+        default_session = 'connection-{}'.format(connection)
+        used = set()
+        try:
+            while True:
+                try:
+                    length, = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+                    header = json.loads(await reader.readexactly(length))
+                    payload = await reader.readexactly(header.get('size', 0))
+                except asyncio.IncompleteReadError:
+                    break
+
+                if header.get('type') == 'stats':
+                    reply = self.stats()
+                else:
+                    name = header.setdefault('session', default_session)
+                    if name not in used:
+                        used.add(name)
+                        self._users.setdefault(name, set()).add(connection)
+                    done = asyncio.get_running_loop().create_future()
+                    self._queue.put_nowait((time.perf_counter(), header, payload, done))
+                    reply = await done
+                writer.write(_encode(reply))
+                await writer.drain()
+        finally:
+            self._connections -= 1
+            for name in used:
+                users = self._users[name]
+                users.discard(connection)
+                if not users:
+                    del self._users[name]
+                    self.sessions.pop(name, None)
+            writer.close()
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.metrics.count('server_batches')
+            self.metrics.count('server_batched_requests', len(batch))
+            asyncio.ensure_future(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        """Hands the requests of every session of the batch to the pool"""
+        by_session = {}
+        for request in batch:
+            by_session.setdefault(request[1]['session'], []).append(request)
+
+        loop = asyncio.get_running_loop()
+        futures = [
+            loop.run_in_executor(self._executor, self._process, self._session(name), requests)
+            for name, requests in by_session.items()
+        ]
+        for requests, future in zip(by_session.values(), futures):
+            try:
+                replies = await future
+            except Exception as error:
+                replies = [{'error': str(error)}] * len(requests)
+            for (queued, _, _, done), reply in zip(requests, replies):
+                self.metrics.record('server_request', time.perf_counter() - queued)
+                if not done.done():
+                    done.set_result(reply)
+
+    def _process(self, session, requests):
+        """Analyzes the frames of a session, in the order they came"""
+        replies = []
+        with session.lock:
+            for _, header, payload, _ in requests:
+                try:
+                    frame = decode_frame(header, payload)
+                    with self.metrics.timer('server_analysis'):
+                        face = session.analyze(frame, header.get('features'))
+                    result = FaceResult.from_face(face, header.get('index', 0), header.get('timestamp'))
+                    replies.append(result.as_dict())
+                    self.metrics.count('server_frames')
+                except Exception as error:
+                    self.metrics.count('server_errors')
+                    replies.append({'error': str(error)})
+        return replies
+
+
+class AnalysisClient(object):
+    """Blocking client of the AnalysisServer"""
+
+    def __init__(self, path=DEFAULT_SOCKET, session=None):
+        """
+        Arguments:
+            path (str): Path of the Unix socket of the server
+            session (str): Session of the frames, shared with other clients
+                using the same name. One per connection by default
+        """
+        self.session = session
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._file = self._socket.makefile('rb')
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _request(self, header, payload=b''):
+        header['size'] = len(payload)
+        self._socket.sendall(_encode(header) + payload)
+        length, = _LENGTH.unpack(self._file.read(_LENGTH.size))
+        return json.loads(self._file.read(length))
+
+    def analyze(self, frame, encoding='raw', index=0, timestamp=None, features=None):
+        """Returns the analysis of a frame as a dict, see result.FaceResult.
+
+        Arguments:
+            frame (numpy.ndarray): BGR frame
+            encoding (str): 'raw' sends the pixels, 'image' a JPEG of the frame
+            index (int): Index of the frame, sent back as is
+            timestamp (float): Time of the frame, sent back as is
+            features (tuple): Features to analyze, see Face.FEATURES
+        """
+        header = {'type': 'analyze', 'encoding': encoding, 'index': index, 'timestamp': timestamp}
+        if self.session is not None:
+            header['session'] = self.session
+        if features is not None:
+            header['features'] = list(features)
+        if encoding == 'image':
+            payload = cv2.imencode('.jpg', frame)[1].tobytes()
+        else:
+            frame = np.ascontiguousarray(frame, dtype=np.uint8)
+            header['shape'] = list(frame.shape)
+            payload = frame.tobytes()
+        return self._request(header, payload)
+
+    def stats(self):
+        return self._request({'type': 'stats'})
+
+
+def _load_client(path, frames, encoding, latencies, errors):
+    with AnalysisClient(path) as client:
+        for index, frame in enumerate(frames):
+            started = time.perf_counter()
+            reply = client.analyze(frame, encoding, index)
+            latencies.append(time.perf_counter() - started)
+            if 'error' in reply:
+                errors.append(reply['error'])
+
+
+def generate_load(path, frames, clients=4, encoding='raw'):
+    """Sends the frames from several clients at once, each on its own thread.
+
+    Returns:
+        The frames per second, the request latency percentiles (ms), the
+        errors and the server stats
+    """
+    latencies, errors = [], []
+    threads = [
+        threading.Thread(target=_load_client, args=(path, frames, encoding, latencies, errors))
+        for _ in range(clients)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    p50, p90, p99 = np.percentile(np.array(latencies) * 1e3, (50, 90, 99)) if latencies else (0, 0, 0)
+    with AnalysisClient(path) as client:
+        stats = client.stats()
+    return {
+        'fps': len(latencies) / seconds,
+        'p50_ms': float(p50),
+        'p90_ms': float(p90),
+        'p99_ms': float(p99),
+        'errors': len(errors),
+        'server': stats,
+    }
+
+
+def _read_frames(video, nb_frames):
+    capture = cv2.VideoCapture(video)
+    frames = []
+    while len(frames) < nb_frames:
+        success, frame = capture.read()
+        if not success:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local FacePuppet analysis server")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help="path of the Unix socket")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    serve = commands.add_parser('serve', help="loads the predictor and serves the analysis")
+    serve.add_argument('--model', required=True, help="path of the 68 points shape predictor")
+    serve.add_argument('--workers', type=int, default=4)
+    serve.add_argument('--max-batch', type=int, default=8)
+    serve.add_argument('--max-delay', type=float, default=0.002, help="seconds")
+    serve.add_argument('--detection-scale', type=float, default=1.0)
+
+    load = commands.add_parser('load', help="sends the frames of a video from several clients")
+    load.add_argument('--video', required=True)
+    load.add_argument('--frames', type=int, default=100, help="frames sent by every client")
+    load.add_argument('--clients', type=int, default=4)
+    load.add_argument('--encoding', choices=('raw', 'image'), default='raw')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        import dlib
+        server = AnalysisServer(
+            dlib.shape_predictor(args.model), args.socket,
+            workers=args.workers,
+            max_batch=args.max_batch,
+            max_delay=args.max_delay,
+            detection_scale=args.detection_scale
+        )
+        try:
+            asyncio.run(server.serve())
+        except KeyboardInterrupt:
+            pass
+    else:
+        report = generate_load(args.socket, _read_frames(args.video, args.frames), args.clients, args.encoding)
+        server = report.pop('server')
+        print("{fps:.1f} frames/s  p50 {p50_ms:.2f}ms  p90 {p90_ms:.2f}ms  p99 {p99_ms:.2f}ms  {errors} errors".format(
+            **report
+        ))
+        print(json.dumps(server, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import threading
+import numpy as np
+import cv2
+from .calibration import Calibration
+from .face import CameraSpecs, Face
+from .landmarks import Landmarks, bounds_overlap
+from .metrics import NULL_METRICS
+
+
+class FaceSession(object):
+    """
+    This class holds the state that outlives a single frame: the pupil
+    calibration and the camera internals. A Face built from a session
+    reuses them instead of starting from scratch on every frame.
+    """
+
+    def __init__(
+            self,
+            dimensions,
+            warm_start=True,
+            small_motion=1.0,
+            refine_iterations=5,
+            landmark_filter=None,
+            metrics=NULL_METRICS,
+            track_pupils=True,
+            calibration=None,
+            history=None
+    ):
+        """
+        Arguments:
+            dimensions (tuple): Dimensions of the frames
+            warm_start (bool): Seeds the head pose estimation with the previous pose
+            small_motion (float): Largest move (in pixels) of the head tilt landmarks
+                for which the previous pose is only refined. 0 always runs solvePnP
+            refine_iterations (int): Iterations of the refinement on small moves
+            landmark_filter: Builds the temporal filter of the landmarks of this
+                session, e.g. functools.partial(filters.OneEuroFilter, beta=0.1)
+            metrics (metrics.Metrics): Records the time spent in every stage, can be
+                shared by several sessions
+            track_pupils (bool): Searches the pupils around their previous position first
+            calibration (calibration.Calibration): Calibration to start from, e.g. a
+                profile of calibration.CalibrationProfiles, a new one by default
+            history (result.ResultHistory): Receives the result of every frame
+        """
+        self.dimensions = dimensions
+        self.calibration = calibration if calibration is not None else Calibration()
+        # Camera internals
+        self.camera_specs = CameraSpecs(dimensions)
+        self.nb_frames = 0
+        self.metrics = metrics
+
+        # Last good head pose, used as initial guess for the next frame
+        self.warm_start = warm_start
+        self.small_motion = small_motion
+        self.refine_criteria = (
+            cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, refine_iterations, 1e-6
+        )
+        self.rotation_vector = None
+        self.translation_vector = None
+        self._image_points = None
+
+        self.landmark_filter = landmark_filter() if landmark_filter is not None else None
+
+        # Last pupil coordinates of each side, in the frame
+        self.track_pupils = track_pupils
+        self.pupils = {}
+        # Eyes of the last full analysis, shown again by the degraded ones
+        self.last_eyes = None
+
+        self.history = history
+
+    def has_pose(self):
+        """Returns true if the previous frame left a pose to start from"""
+        return self.warm_start and self.rotation_vector is not None
+
+    def is_small_motion(self, image_points):
+        """Returns true if the head tilt landmarks barely moved since the last pose"""
+        moves = np.linalg.norm(image_points - self._image_points, axis=1)
+        return np.max(moves) <= self.small_motion
+
+    def update_pose(self, rotation_vector, translation_vector, image_points):
+        self.rotation_vector = rotation_vector
+        self.translation_vector = translation_vector
+        self._image_points = image_points
+
+    def reset_pose(self):
+        """Forgets the last pose, e.g. when the face was lost"""
+        self.rotation_vector = None
+        self.translation_vector = None
+        self._image_points = None
+
+    def update_pupils(self, eyes):
+        """Keeps the pupil coordinates found by the eyes for the next frame"""
+        if not self.track_pupils:
+            return
+        for eye in eyes:
+            if eye.pupils_located:
+                self.pupils[eye.side] = eye.pupil_coords()
+            else:
+                self.pupils.pop(eye.side, None)
+
+    def reset_tracking(self):
+        """Forgets everything carried over from the previous frame"""
+        self.reset_pose()
+        self.pupils = {}
+        self.last_eyes = None
+
+    def filter_landmarks(self, landmarks, timestamp=None):
+        """Smooths the landmarks with the landmark filter of the session, if any"""
+        if self.landmark_filter is None:
+            return landmarks
+        if landmarks is None:
+            self.landmark_filter.reset()
+            return None
+        return Landmarks(self.landmark_filter(Landmarks.wrap(landmarks).points, timestamp))
+
+    def analyze(self, frame, landmarks, greyframe=None, timestamp=None, features=None, pose=None,
+                degraded=False):
+        """Builds and analyzes the Face for a new frame.
+
+        Arguments:
+            frame (numpy.ndarray): Frame passed by the user
+            landmarks (landmarks.Landmarks): Facial landmarks for the face region
+            greyframe (numpy.ndarray): Grey version of the frame, if already computed
+            timestamp (float): Time of the frame in seconds, for the landmark filter
+            features (tuple): Features to analyze on top of the head pose,
+                see Face.FEATURES, all of them by default
+            pose (tuple): Rotation and translation vectors of the landmarks, if
+                already known, the head pose is not estimated again
+            degraded (bool): Only analyzes the landmarks, the last pose and eyes
+                are reused (see scheduler.FrameScheduler)
+
+        Returns:
+            The analyzed Face
+        """
+        if degraded:
+            features = tuple(
+                feature for feature in (Face.FEATURES if features is None else features) if feature != 'eyes'
+            )
+            if pose is None and self.rotation_vector is not None:
+                pose = (self.rotation_vector, self.translation_vector)
+
+        with self.metrics.timer('face'):
+            landmarks = self.filter_landmarks(landmarks, timestamp)
+            face = Face(
+                frame, self.dimensions, landmarks,
+                session=self, greyframe=greyframe, features=features, pose=pose
+            )
+            face.analyze()
+        if face.eyes is not None:
+            self.last_eyes = face.eyes
+        elif degraded and face.is_detected():
+            face.eyes = self.last_eyes
+        if self.history is not None:
+            self.history.append(face.to_result(self.nb_frames, timestamp))
+        self.nb_frames += 1
+        self.metrics.count('frames')
+        if landmarks is None:
+            self.metrics.count('faces_missing')
+        self.metrics.maybe_export()
+        return face
+
+
+class MultiFaceSession(object):
+    """
+    This class follows every face of the video. A face keeps the same id,
+    and so its own FaceSession, from one frame to the next as long as its
+    landmarks overlap with the ones of the previous frame. The faces of a
+    frame are analyzed in parallel, and only the eye patches of the frame
+    are converted to grey.
+    """
+
+    def __init__(self, dimensions, min_overlap=0.3, max_missed=5, workers=4, **session_options):
+        """
+        Arguments:
+            dimensions (tuple): Dimensions of the frames
+            min_overlap (float): Minimum overlap of the landmarks between two
+                frames to consider it's the same face
+            max_missed (int): Number of frames without a face before its session is dropped
+            workers (int): Number of threads analyzing the faces
+            session_options: Passed on to every FaceSession
+        """
+        self.dimensions = dimensions
+        self.min_overlap = min_overlap
+        self.max_missed = max_missed
+        self.session_options = session_options
+
+        self.sessions = {}
+        self._bounds = {}
+        self._missed = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def close(self):
+        self._executor.shutdown()
+
+    def _match(self, faces):
+        """Returns the id of each face, matching them greedily by overlap"""
+        bounds = [landmarks.bounds() for landmarks in faces]
+        pairs = sorted(
+            (
+                (bounds_overlap(face_bounds, previous_bounds), index, face_id)
+                for index, face_bounds in enumerate(bounds)
+                for face_id, previous_bounds in self._bounds.items()
+            ),
+            key=lambda pair: pair[0],
+            reverse=True
+        )
+
+        ids = [None] * len(faces)
+        taken = set()
+        for overlap, index, face_id in pairs:
+            if overlap < self.min_overlap:
+                break
+            if ids[index] is None and face_id not in taken:
+                ids[index] = face_id
+                taken.add(face_id)
+
+        for index, face_id in enumerate(ids):
+            if face_id is None:
+                face_id = next(self._ids)
+                ids[index] = face_id
+                self.sessions[face_id] = FaceSession(self.dimensions, **self.session_options)
+            self._bounds[face_id] = bounds[index]
+            self._missed[face_id] = 0
+
+        for face_id in list(self.sessions):
+            if face_id in taken or face_id in ids:
+                continue
+            self._missed[face_id] += 1
+            if self._missed[face_id] == 1:
+                # the face may come back elsewhere, its pose, pupils and
+                # filter would drag it back to where it was lost
+                self.sessions[face_id].reset_tracking()
+                self.sessions[face_id].filter_landmarks(None)
+            if self._missed[face_id] > self.max_missed:
+                del self.sessions[face_id]
+                del self._bounds[face_id]
+                del self._missed[face_id]
+
+        return ids
+
+    def analyze(self, frame, faces, timestamp=None, features=None, degraded=False):
+        """Analyzes all the faces of a new frame.
+
+        Arguments:
+            frame (numpy.ndarray): Frame passed by the user
+            faces (list): Facial landmarks of every face (see FaceLocator.locate_all)
+            timestamp (float): Time of the frame in seconds, for the landmark filters
+            features (tuple): Features to analyze, see Face.FEATURES
+            degraded (bool): Only analyzes the landmarks, see FaceSession.analyze
+
+        Returns:
+            A dict of the analyzed Face of every face id
+        """
+        faces = [Landmarks.wrap(landmarks) for landmarks in faces]
+        with self._lock:
+            ids = self._match(faces)
+            sessions = [self.sessions[face_id] for face_id in ids]
+        if not faces:
+            return {}
+
+        if len(faces) == 1:
+            return {ids[0]: sessions[0].analyze(frame, faces[0], None, timestamp, features, degraded=degraded)}
+
+        futures = [
+            self._executor.submit(
+                session.analyze, frame, landmarks, None, timestamp, features, degraded=degraded
+            )
+            for session, landmarks in zip(sessions, faces)
+        ]
+        return {face_id: future.result() for face_id, future in zip(ids, futures)}
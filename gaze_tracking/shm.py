@@ -0,0 +1,219 @@
+"""
+Shared memory ring buffer of the analysis results, so that renderers in
+other processes, or written in other languages, read them at camera rate
+without pickling.
+
+The block starts with a HEADER, followed, 64 bytes aligned, by capacity
+RECORD slots then, optionally, by capacity frames of frame_shape uint8
+pixels. All the fields are little endian and packed, but the slots are
+padded to record_size (960) bytes, a multiple of 64: every slot starts on
+a cache line, so its sequence and position are aligned and can be read
+atomically. Readers step over the slots by record_size. The n-th result
+published (n from 0) goes to slot n % capacity, and write_count in the
+header is the number of results published so far.
+
+Every slot is guarded by a sequence lock: its sequence is odd while the
+writer fills it and goes up by 2 each time. A reader copies the slot and
+keeps the copy only if the sequence was even and did not change, and if
+the position of the slot is still the one it wanted.
+
+The fields of the results are described in result.py.
+"""
+from multiprocessing import shared_memory
+import numpy as np
+from .result import FaceResult, RESULT
+
+MAGIC = b'FPRB'
+VERSION = 2
+
+HEADER = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u4'),
+    ('capacity', '<u4'),
+    ('record_size', '<u4'),
+    ('frame_shape', '<u4', (3,)),
+    ('write_count', '<u8'),
+])
+
+# A result.RESULT preceded by the fields of the ring, padded to 64 bytes
+_FIELDS = [
+    ('sequence', '<u8'),
+    # write count of the result in the slot
+    ('position', '<u8'),
+    ('has_frame', 'u1'),
+] + [(name, RESULT.fields[name][0]) for name in RESULT.names]
+RECORD = np.dtype(_FIELDS + [('padding', 'V{}'.format(-np.dtype(_FIELDS).itemsize % 64))])
+
+
+def _aligned(size, alignment=64):
+    return (size + alignment - 1) // alignment * alignment
+
+
+class ResultRing(object):
+    """
+    This class is the ring buffer, on the writer side (create) as well as on
+    the reader side (attach). There must be a single writer.
+    """
+
+    def __init__(self, memory, owner):
+        self.memory = memory
+        self.owner = owner
+        buffer = memory.buf
+
+        self.header = np.ndarray((), HEADER, buffer, 0)
+        if self.header['magic'] != MAGIC or self.header['version'] != VERSION:
+            raise ValueError("{} is not a FacePuppet result ring".format(memory.name))
+        self.capacity = int(self.header['capacity'])
+        self.frame_shape = tuple(int(d) for d in self.header['frame_shape'])
+
+        offset = _aligned(HEADER.itemsize)
+        self.records = np.ndarray((self.capacity,), RECORD, buffer, offset)
+        self.frames = None
+        if self.frame_shape[0]:
+            offset = _aligned(offset + RECORD.itemsize * self.capacity)
+            self.frames = np.ndarray((self.capacity,) + self.frame_shape, np.uint8, buffer, offset)
+
+    @classmethod
+    def size(cls, capacity, frame_shape=None):
+        """Returns the number of bytes of a ring"""
+        size = _aligned(HEADER.itemsize) + RECORD.itemsize * capacity
+        if frame_shape is not None:
+            size = _aligned(size) + capacity * int(np.prod(frame_shape))
+        return size
+
+    @classmethod
+    def create(cls, name=None, capacity=64, frame_shape=None):
+        """Creates the shared memory of a new ring, to write to.
+
+        Arguments:
+            name (str): Name of the shared memory, a random one by default
+            capacity (int): Number of results kept
+            frame_shape (tuple): Shape (height, width, channels) of the frames
+                published with the results, no frames by default
+        """
+        memory = shared_memory.SharedMemory(name, create=True, size=cls.size(capacity, frame_shape))
+        header = np.ndarray((), HEADER, memory.buf, 0)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['capacity'] = capacity
+        header['record_size'] = RECORD.itemsize
+        if frame_shape is not None:
+            header['frame_shape'] = tuple(frame_shape) + (1,) * (3 - len(frame_shape))
+        header['write_count'] = 0
+        del header
+        ring = cls(memory, owner=True)
+        ring.records.fill(0)
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        """Opens the ring created under that name by another process, to read from"""
+        # only the creator removes the memory, python would on exit otherwise
+        try:
+            memory = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # before python 3.13
+            from multiprocessing import resource_tracker
+            memory = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        return cls(memory, owner=False)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def write_count(self):
+        return int(self.header['write_count'])
+
+    def close(self):
+        # the views must go before the memory is closed
+        del self.header, self.records, self.frames
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def publish(self, face, frame_index=0, timestamp=None, frame=None):
+        """Writes the analysis of a frame into the next slot.
+
+        Arguments:
+            face: Analyzed face.Face or its result.FaceResult, None if there was none
+            frame_index (int): Index of the frame
+            timestamp (float): Time of the frame, now by default
+            frame (numpy.ndarray): The frame, copied along if the ring has frames
+
+        Returns:
+            The position of the result
+        """
+        position = self.write_count
+        slot = position % self.capacity
+        record = self.records[slot]
+        sequence = int(record['sequence'])
+
+        record['sequence'] = sequence + 1
+        record['position'] = position
+        if not isinstance(face, FaceResult):
+            face = FaceResult.from_face(face, frame_index, timestamp)
+        face.to_record(record)
+        has_frame = self.frames is not None and frame is not None
+        if has_frame:
+            self.frames[slot].reshape(frame.shape)[...] = frame
+        record['has_frame'] = has_frame
+        record['sequence'] = sequence + 2
+
+        self.header['write_count'] = position + 1
+        return position
+
+    def read(self, position, frame=None, retries=100):
+        """Returns a copy of the record at a position, or None if it was
+        overwritten already or isn't written yet.
+
+        Arguments:
+            position (int): Position of the result, from 0
+            frame (numpy.ndarray): Receives a copy of the frame, if given
+            retries (int): Number of attempts while the writer is on the slot
+        """
+        slot = position % self.capacity
+        sequences = self.records['sequence']
+        for _ in range(retries):
+            before = int(sequences[slot])
+            if before % 2:
+                continue
+            record = self.records[slot].copy()
+            if frame is not None and record['has_frame']:
+                np.copyto(frame, self.frames[slot].reshape(frame.shape))
+            if int(sequences[slot]) != before:
+                continue
+            if record['position'] != position or not before:
+                return None
+            return record
+        return None
+
+    def latest(self, frame=None):
+        """Returns a copy of the last record published, or None if there is
+        none or its slot stays locked (e.g. the writer died while on it)"""
+        count = self.write_count
+        while count:
+            record = self.read(count - 1, frame)
+            if record is not None:
+                return record
+            if self.write_count == count:
+                # the writer didn't move on, trying again wouldn't help
+                return None
+            # lapped by the writer, try the newest again
+            count = self.write_count
+        return None
+
+    def read_since(self, position):
+        """Returns the records published from a position on, still in the ring,
+        and the position to read from next time"""
+        count = self.write_count
+        start = max(position, count - self.capacity)
+        records = [self.read(index) for index in range(start, count)]
+        return [record for record in records if record is not None], count
@@ -1,15 +1,14 @@
 import numpy as np
 import cv2
 
-class ThreeDimensionalCalc():
-    DIST_COEFFS = np.zeros((4, 1))
-    def __init__(
-            self,
-            rotation_vec,
-            translation_vec,
-            camera_matrix,
-            frame_shape
-    ):
+class CameraProjection(object):
+    """
+    The part of the back-projection that only depends on the camera and
+    the frame dimensions. It is computed once per camera and cached.
+    """
+    _cache = {}
+
+    def __init__(self, camera_matrix, frame_shape):
         # We can assume we're calculating based off the tip of the nose.
         # I believe we can assume this is in the center of the screen.
         # I also don't think it's important where the nose is in 3d space really.
@@ -23,6 +22,35 @@ class ThreeDimensionalCalc():
         ref_point = np.array(
             [[x], [y], [1]], dtype="double"
         )
+        self.camera_matrix = camera_matrix
+        self.camera_matrix_inv = np.linalg.inv(camera_matrix)
+        self.ref_ray = np.dot(self.camera_matrix_inv, ref_point)
+
+    @classmethod
+    def for_camera(cls, camera_matrix, frame_shape):
+        """Returns the cached projection for this camera matrix and frame size"""
+        key = (tuple(frame_shape), np.asarray(camera_matrix, dtype="double").tobytes())
+        projection = cls._cache.get(key)
+        if projection is None:
+            projection = cls(camera_matrix, frame_shape)
+            cls._cache[key] = projection
+        return projection
+
+
+class ThreeDimensionalCalc():
+    DIST_COEFFS = np.zeros((4, 1))
+    def __init__(
+            self,
+            rotation_vec,
+            translation_vec,
+            camera_matrix,
+            frame_shape,
+            projection=None
+    ):
+        # Everything depending on the camera only comes precomputed,
+        # a frame only pays for its own pose.
+        if projection is None:
+            projection = CameraProjection.for_camera(camera_matrix, frame_shape)
         z_const = 0.0
         # transform the vectors into matricies.
         self.rotation_matrix, _ = cv2.Rodrigues(rotation_vec)
@@ -30,23 +58,21 @@ class ThreeDimensionalCalc():
         self.translation_vec = translation_vec
         self.camera_matrix = camera_matrix
 
-        self._rotation_matrix_inv = np.linalg.inv(self.rotation_matrix)
-        self._camera_matrix_inv = np.linalg.inv(self.camera_matrix)
+        # The inverse of a rotation matrix is its transpose.
+        self._rotation_matrix_inv = self.rotation_matrix.T
+        self._camera_matrix_inv = projection.camera_matrix_inv
 
-        leftSideMat_part = np.dot(
-            self._rotation_matrix_inv,
-            self._camera_matrix_inv
-        )
         self._leftSideMat = np.dot(
-            leftSideMat_part,
-            ref_point
+            self._rotation_matrix_inv,
+            projection.ref_ray
         )
         self._rightSideMat = np.dot(
-            np.linalg.inv(self.rotation_matrix),
+            self._rotation_matrix_inv,
             self.translation_vec
         )
 
         self.scale_const = z_const + (self._rightSideMat[2, 0] / self._leftSideMat[2, 0])
+        self._scaled_camera_matrix_inv = self.scale_const*self._camera_matrix_inv
 
         # roll = np.clip(np.degrees(steady_pose[0][1]), -90, 90)
         # pitch = np.clip(-(180 + np.degrees(steady_pose[0][0])), -90, 90)
@@ -63,11 +89,93 @@ class ThreeDimensionalCalc():
         return np.dot(
             self._rotation_matrix_inv,
             np.dot(
-                self.scale_const*self._camera_matrix_inv,
+                self._scaled_camera_matrix_inv,
                 point
             ) - self.translation_vec
         )
 
+    def to_3d_batch(self, points):
+        """Same as to_3d for several points at once.
+
+        Argument:
+            points (numpy.ndarray): (N, 2) image points
+
+        Returns:
+            A (3, N) array, the column i being to_3d(points[i])
+        """
+        points = np.asarray(points, dtype="double").reshape(-1, 2)
+        points = np.vstack((points.T, np.ones(len(points))))
+        return np.dot(
+            self._rotation_matrix_inv,
+            np.dot(
+                self._scaled_camera_matrix_inv,
+                points
+            ) - self.translation_vec
+        )
+
+    @staticmethod
+    def rotation_matrices(rotation_vecs):
+        """Rodrigues conversion of several rotation vectors at once.
+
+        Argument:
+            rotation_vecs (numpy.ndarray): (F, 3) rotation vectors
+
+        Returns:
+            A (F, 3, 3) array of rotation matrices
+        """
+        rotation_vecs = np.asarray(rotation_vecs, dtype="double").reshape(-1, 3)
+        theta = np.linalg.norm(rotation_vecs, axis=1)
+        axis = rotation_vecs / np.where(theta > 0, theta, 1)[:, None]
+
+        skew = np.zeros((len(axis), 3, 3))
+        skew[:, 0, 1] = -axis[:, 2]
+        skew[:, 0, 2] = axis[:, 1]
+        skew[:, 1, 0] = axis[:, 2]
+        skew[:, 1, 2] = -axis[:, 0]
+        skew[:, 2, 0] = -axis[:, 1]
+        skew[:, 2, 1] = axis[:, 0]
+
+        sin = np.sin(theta)[:, None, None]
+        cos = np.cos(theta)[:, None, None]
+        return np.eye(3) + sin * skew + (1 - cos) * np.matmul(skew, skew)
+
+    @staticmethod
+    def to_3d_frames(rotation_vecs, translation_vecs, camera_matrix, frame_shape, points):
+        """Same as to_3d for a whole recorded sequence, each frame with its own pose.
+
+        Arguments:
+            rotation_vecs (numpy.ndarray): (F, 3) rotation vectors
+            translation_vecs (numpy.ndarray): (F, 3) translation vectors
+            camera_matrix (numpy.ndarray): Camera matrix shared by all the frames
+            frame_shape (tuple): Dimensions of the frames
+            points (numpy.ndarray): (F, N, 2) image points
+
+        Returns:
+            A (F, N, 3) array of 3d points
+        """
+        translation_vecs = np.asarray(translation_vecs, dtype="double").reshape(-1, 3, 1)
+        points = np.asarray(points, dtype="double")
+        nb_frames, nb_points = points.shape[:2]
+
+        # The inverse of a rotation matrix is its transpose.
+        rotation_matrix_inv = np.transpose(
+            ThreeDimensionalCalc.rotation_matrices(rotation_vecs), (0, 2, 1)
+        )
+        projection = CameraProjection.for_camera(camera_matrix, frame_shape)
+        camera_matrix_inv = projection.camera_matrix_inv
+
+        left_side = np.matmul(rotation_matrix_inv, projection.ref_ray)
+        right_side = np.matmul(rotation_matrix_inv, translation_vecs)
+        scale_const = right_side[:, 2, 0] / left_side[:, 2, 0]
+
+        points = np.concatenate((points, np.ones((nb_frames, nb_points, 1))), axis=2)
+        rays = np.matmul(camera_matrix_inv, np.transpose(points, (0, 2, 1)))
+        points_3d = np.matmul(
+            rotation_matrix_inv,
+            scale_const[:, None, None] * rays - translation_vecs
+        )
+        return np.transpose(points_3d, (0, 2, 1))
+
     def to_2d(self, points):
         point_3d = np.array(points, dtype=np.float32).reshape(-1, 3)
         (point_2d, _) = cv2.projectPoints(point_3d,
@@ -101,14 +209,58 @@ class FeatureVectorFinder(object):
     ):
         self.landmarks = landmarks
         self._calculator = calculator
-        start_point_2d = np.array(
-            [
-                self.landmarks.part(self.TIP_OF_NOSE).x, self.landmarks.part(self.TIP_OF_NOSE).y
-            ], dtype=np.float32
-        )
+        start_point_2d = self.landmarks[self.TIP_OF_NOSE].astype(np.float32)
         self._start_point = self._calculator.to_3d(start_point_2d)
 
     def find_vector(self, point): # returns (start, end, distance)
         point_3d = self._calculator.to_3d(point)
         dist = self._calculator.find_distance(self._start_point, point_3d)
         return (self._start_point, point_3d, dist)
+
+    def find_vectors(self, points): # returns [(start, end, distance), ...]
+        """Same as find_vector for several points, back-projected together.
+
+        Argument:
+            points (list): Image points (x, y)
+        """
+        points_3d = self._calculator.to_3d_batch(points)
+        dists = self._calculator.find_distance(self._start_point, points_3d)
+        return [
+            (self._start_point, points_3d[:, [i]], dists[[i]])
+            for i in range(points_3d.shape[1])
+        ]
+
+    @classmethod
+    def find_vectors_over_frames(
+            cls,
+            landmarks,
+            points,
+            rotation_vecs,
+            translation_vecs,
+            camera_matrix,
+            frame_shape
+    ):
+        """Same as find_vectors for a recorded sequence of frames.
+
+        Arguments:
+            landmarks (numpy.ndarray): (F, 68, 2) landmarks of every frame
+            points (numpy.ndarray): (F, N, 2) image points of every frame
+            rotation_vecs (numpy.ndarray): (F, 3) rotation vectors
+            translation_vecs (numpy.ndarray): (F, 3) translation vectors
+            camera_matrix (numpy.ndarray): Camera matrix shared by all the frames
+            frame_shape (tuple): Dimensions of the frames
+
+        Returns:
+            starts (F, 3), ends (F, N, 3) and distances (F, N)
+        """
+        landmarks = np.asarray(landmarks)
+        points = np.concatenate(
+            (landmarks[:, [cls.TIP_OF_NOSE]], np.asarray(points)), axis=1
+        )
+        points_3d = ThreeDimensionalCalc.to_3d_frames(
+            rotation_vecs, translation_vecs, camera_matrix, frame_shape, points
+        )
+        starts = points_3d[:, 0]
+        ends = points_3d[:, 1:]
+        dists = np.linalg.norm(ends - starts[:, None], axis=2)
+        return starts, ends, dists